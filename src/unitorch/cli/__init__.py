@@ -11,6 +11,7 @@ import importlib
 import importlib_resources
 import importlib.metadata as importlib_metadata
 from functools import partial
+from concurrent.futures import ThreadPoolExecutor
 from typing import Any, Callable, Dict, List, Optional, Set, Tuple, Union
 from transformers.utils import is_remote_url
 from unitorch.utils import cached_path as hf_cached_path
@@ -90,11 +91,31 @@ def cached_path(
     )
 
 
+def cached_paths(
+    urls_or_filenames: List[Optional[str]],
+    max_workers: Optional[int] = None,
+    **kwargs,
+) -> List[Optional[str]]:
+    # resolve several paths concurrently, keeping order and passing None through
+    def _cached_path(url_or_filename):
+        if url_or_filename is None:
+            return None
+        return cached_path(url_or_filename, **kwargs)
+
+    if max_workers is None:
+        max_workers = max(len(urls_or_filenames), 1)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(_cached_path, urls_or_filenames))
+
+
 from unitorch.cli.decorators import (
     add_default_section_for_init,
     add_default_section_for_function,
 )
 
+# resolved from_core_configure factories, keyed by (registry, name)
+registered_factories = dict()
+
 
 # registry function
 def registry_func(
@@ -109,6 +130,7 @@ def registry_func(
                 "decorators": decorators,
             }
         )
+        registered_factories.pop((id(save_dict), name), None)
         return obj
 
     return actual_func
@@ -179,11 +201,20 @@ def init_registered_module(
     if name not in registered_module:
         return
 
-    v = registered_module[name]
+    factory = get_registered_factory(name, registered_module)
+    return factory(config, **kwargs)
 
-    if v["decorators"]:
-        return v["decorators"](v["obj"]).from_core_configure(config, **kwargs)
-    return v["obj"].from_core_configure(config, **kwargs)
+
+def get_registered_factory(
+    name: str,
+    registered_module: Dict,
+):
+    key = (id(registered_module), name)
+    if key not in registered_factories:
+        v = registered_module[name]
+        obj = v["decorators"](v["obj"]) if v["decorators"] else v["obj"]
+        registered_factories[key] = obj.from_core_configure
+    return registered_factories[key]
 
 
 def init_registered_process(
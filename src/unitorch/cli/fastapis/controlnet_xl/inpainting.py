@@ -7,7 +7,9 @@ import json
 import logging
 import torch
 import hashlib
+import threading
 import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
 from PIL import Image
 from torch import autocast
 from fastapi import APIRouter, UploadFile, File
@@ -23,14 +25,15 @@ from diffusers.pipelines import (
     StableDiffusionXLControlNetImg2ImgPipeline,
     StableDiffusionXLControlNetInpaintPipeline,
 )
-from unitorch import is_xformers_available
 from unitorch.utils import is_remote_url
 from unitorch.models.diffusers import GenericStableXLModel
 from unitorch.models.diffusers import StableXLProcessor
+from unitorch.models.diffusers.modeling_controlnet import _enable_efficient_attention
 
 from unitorch.utils import pop_value, nested_dict_value
 from unitorch.cli import (
     cached_path,
+    cached_paths,
     register_fastapi,
     add_default_section_for_init,
     add_default_section_for_function,
@@ -41,9 +44,78 @@ from unitorch.cli.models.diffusers import (
     pretrained_stable_extensions_infos,
     load_weight,
 )
+from unitorch.cli.models.diffusion_utils import cache_scheduler_timesteps
 from unitorch.cli.pipelines import Schedulers
 
 
+def _quantize_denoisers(model, quantization, device):
+    if quantization != "fp8":
+        raise ValueError(f"Unsupported quantization {quantization}.")
+    # dynamic fp8 activations need fp8 tensor cores (sm_89+)
+    if torch.cuda.get_device_capability(device) >= (8, 9):
+        model.quantize_float8_dynamic(modules=["unet", "controlnet"])
+    else:
+        logging.warning("FP8 matmul is not supported, use fp8 weight-only instead.")
+        model.quantize_float8(modules=["unet", "controlnet"])
+
+
+def _stage_input(tensor, device, pin_memory):
+    if pin_memory:
+        tensor = tensor.pin_memory()
+    return tensor.to(device=device, non_blocking=pin_memory)
+
+
+def _clone_outputs(outputs):
+    if isinstance(outputs, torch.Tensor):
+        return outputs.clone()
+    if isinstance(outputs, tuple):
+        return tuple(_clone_outputs(o) for o in outputs)
+    return type(outputs)(**{k: _clone_outputs(v) for k, v in outputs.items()})
+
+
+class _CUDAGraphForward:
+    """Replay captured cuda graphs of a frozen text encoder for fixed-shape ids."""
+
+    def __init__(self, forward):
+        self.forward = forward
+        self.graphs = dict()
+        # concurrent requests share the static buffers of each graph
+        self.lock = threading.Lock()
+
+    def capture(self, input_ids, output_hidden_states):
+        static_input_ids = input_ids.clone()
+        # warm up on a side stream so lazy initializations are not captured
+        stream = torch.cuda.Stream(device=input_ids.device)
+        stream.wait_stream(torch.cuda.current_stream(input_ids.device))
+        with torch.cuda.stream(stream):
+            for _ in range(2):
+                self.forward(
+                    static_input_ids, output_hidden_states=output_hidden_states
+                )
+        torch.cuda.current_stream(input_ids.device).wait_stream(stream)
+        graph = torch.cuda.CUDAGraph()
+        with torch.cuda.graph(graph):
+            static_outputs = self.forward(
+                static_input_ids, output_hidden_states=output_hidden_states
+            )
+        return graph, static_input_ids, static_outputs
+
+    def __call__(self, input_ids, output_hidden_states=None, **kwargs):
+        if kwargs or input_ids.device.type != "cuda" or torch.is_grad_enabled():
+            return self.forward(
+                input_ids, output_hidden_states=output_hidden_states, **kwargs
+            )
+        key = (tuple(input_ids.shape), input_ids.device, output_hidden_states)
+        with self.lock:
+            if key not in self.graphs:
+                self.graphs[key] = self.capture(input_ids, output_hidden_states)
+            graph, static_input_ids, static_outputs = self.graphs[key]
+            static_input_ids.copy_(input_ids)
+            graph.replay()
+            # the next replay overwrites the static outputs
+            return _clone_outputs(static_outputs)
+
+
 class ControlNetXLForImageInpaintingFastAPIPipeline(GenericStableXLModel):
     def __init__(
         self,
@@ -70,6 +142,10 @@ class ControlNetXLForImageInpaintingFastAPIPipeline(GenericStableXLModel):
         device: Optional[Union[str, int]] = "cpu",
         enable_cpu_offload: Optional[bool] = False,
         enable_xformers: Optional[bool] = False,
+        fuse_qkv_projections: Optional[bool] = True,
+        quantization: Optional[str] = None,
+        enable_vae_tiling: Optional[bool] = True,
+        enable_text_cuda_graph: Optional[bool] = False,
     ):
         super().__init__(
             config_path=config_path,
@@ -92,6 +168,8 @@ class ControlNetXLForImageInpaintingFastAPIPipeline(GenericStableXLModel):
             pad_token2=pad_token2,
         )
         self._device = "cpu" if device == "cpu" else int(device)
+        self._pinned_images = None
+        self._pinned_lock = threading.Lock()
 
         self.from_pretrained(weight_path, state_dict=state_dict)
 
@@ -108,6 +186,7 @@ class ControlNetXLForImageInpaintingFastAPIPipeline(GenericStableXLModel):
             tokenizer_2=None,
         )
         self.pipeline.set_progress_bar_config(disable=True)
+        cache_scheduler_timesteps(self.scheduler)
 
         if lora_checkpoints is not None:
             self.load_lora_weights(
@@ -120,14 +199,50 @@ class ControlNetXLForImageInpaintingFastAPIPipeline(GenericStableXLModel):
         self._enable_cpu_offload = enable_cpu_offload
         self._enable_xformers = enable_xformers
 
+        if self._enable_xformers and self._device != "cpu":
+            _enable_efficient_attention(self)
+
+        # fuse after the processors are set, the fused ones replace them and the
+        # merged lora weights are already in to_q/to_k/to_v
+        if fuse_qkv_projections:
+            controlnet = self.controlnet
+            nets = controlnet.nets if hasattr(controlnet, "nets") else [controlnet]
+            for module in [self.unet] + list(nets):
+                if hasattr(module, "fuse_qkv_projections"):
+                    module.fuse_qkv_projections()
+
+        # quantize before offloading so the offloaded blobs are smaller,
+        # text encoders and vae stay in full precision
+        if quantization is not None and self._device != "cpu":
+            _quantize_denoisers(self, quantization, self._device)
+
+        # decode the batch image by image and large images tile by tile to cap
+        # the decoder activation memory
+        if enable_vae_tiling:
+            self.vae.enable_slicing()
+            self.vae.enable_tiling()
+
+        # nhwc lets cudnn pick the tensor-core conv kernels, the format is kept
+        # when the weights move to the device or get offloaded
+        if self._device != "cpu":
+            self.unet.to(memory_format=torch.channels_last)
+            self.controlnet.to(memory_format=torch.channels_last)
+            self.vae.to(memory_format=torch.channels_last)
+
         if self._enable_cpu_offload and self._device != "cpu":
             self.pipeline.enable_model_cpu_offload(self._device)
         else:
             self.to(device=self._device)
 
-        if self._enable_xformers and self._device != "cpu":
-            assert is_xformers_available(), "Please install xformers first."
-            self.pipeline.enable_xformers_memory_efficient_attention()
+        # the prompt ids are padded to max_seq_length, so the frozen encoders see
+        # fixed shapes and can replay graphs; offloading moves them, skip it then
+        if (
+            enable_text_cuda_graph
+            and self._device != "cpu"
+            and not self._enable_cpu_offload
+        ):
+            self.text.forward = _CUDAGraphForward(self.text.forward)
+            self.text2.forward = _CUDAGraphForward(self.text2.forward)
 
     @classmethod
     @add_default_section_for_init("core/fastapi/pipeline/controlnet_xl/inpainting")
@@ -183,7 +298,6 @@ class ControlNetXLForImageInpaintingFastAPIPipeline(GenericStableXLModel):
             config_path,
             nested_dict_value(pretrained_infos, "unet", "config"),
         )
-        config_path = cached_path(config_path)
 
         text_config_path = text_config_path or config.getoption(
             "text_config_path", None
@@ -192,7 +306,6 @@ class ControlNetXLForImageInpaintingFastAPIPipeline(GenericStableXLModel):
             text_config_path,
             nested_dict_value(pretrained_infos, "text", "config"),
         )
-        text_config_path = cached_path(text_config_path)
 
         text2_config_path = text2_config_path or config.getoption(
             "text2_config_path", None
@@ -201,14 +314,12 @@ class ControlNetXLForImageInpaintingFastAPIPipeline(GenericStableXLModel):
             text2_config_path,
             nested_dict_value(pretrained_infos, "text2", "config"),
         )
-        text2_config_path = cached_path(text2_config_path)
 
         vae_config_path = vae_config_path or config.getoption("vae_config_path", None)
         vae_config_path = pop_value(
             vae_config_path,
             nested_dict_value(pretrained_infos, "vae", "config"),
         )
-        vae_config_path = cached_path(vae_config_path)
 
         controlnet_configs_path = config.getoption("controlnet_configs_path", None)
         if isinstance(controlnet_configs_path, str):
@@ -220,10 +331,7 @@ class ControlNetXLForImageInpaintingFastAPIPipeline(GenericStableXLModel):
                 for pretrained_controlnet_info in pretrained_controlnet_infos
             ],
         )
-        controlnet_configs_path = [
-            cached_path(controlnet_config_path)
-            for controlnet_config_path in controlnet_configs_path
-        ]
+        controlnet_configs_path = cached_paths(controlnet_configs_path)
 
         pretrained_inpainting_controlnet_name = (
             pretrained_inpainting_controlnet_name
@@ -265,35 +373,55 @@ class ControlNetXLForImageInpaintingFastAPIPipeline(GenericStableXLModel):
             scheduler_config_path,
             nested_dict_value(pretrained_infos, "scheduler"),
         )
-        scheduler_config_path = cached_path(scheduler_config_path)
 
         vocab_path = vocab_path or config.getoption("vocab_path", None)
         vocab_path = pop_value(
             vocab_path,
             nested_dict_value(pretrained_infos, "text", "vocab"),
         )
-        vocab_path = cached_path(vocab_path)
 
         merge_path = merge_path or config.getoption("merge_path", None)
         merge_path = pop_value(
             merge_path,
             nested_dict_value(pretrained_infos, "text", "merge"),
         )
-        merge_path = cached_path(merge_path)
 
         vocab2_path = vocab2_path or config.getoption("vocab2_path", None)
         vocab2_path = pop_value(
             vocab2_path,
             nested_dict_value(pretrained_infos, "text2", "vocab"),
         )
-        vocab2_path = cached_path(vocab2_path)
 
         merge2_path = merge2_path or config.getoption("merge2_path", None)
         merge2_path = pop_value(
             merge2_path,
             nested_dict_value(pretrained_infos, "text2", "merge"),
         )
-        merge2_path = cached_path(merge2_path)
+
+        # resolve the config and vocab files concurrently to overlap hub latency
+        (
+            config_path,
+            text_config_path,
+            text2_config_path,
+            vae_config_path,
+            scheduler_config_path,
+            vocab_path,
+            merge_path,
+            vocab2_path,
+            merge2_path,
+        ) = cached_paths(
+            [
+                config_path,
+                text_config_path,
+                text2_config_path,
+                vae_config_path,
+                scheduler_config_path,
+                vocab_path,
+                merge_path,
+                vocab2_path,
+                merge2_path,
+            ]
+        )
 
         quant_config_path = quant_config_path or config.getoption(
             "quant_config_path", None
@@ -310,46 +438,46 @@ class ControlNetXLForImageInpaintingFastAPIPipeline(GenericStableXLModel):
         device = config.getoption("device", "cpu") if device is None else device
         enable_cpu_offload = config.getoption("enable_cpu_offload", True)
         enable_xformers = config.getoption("enable_xformers", True)
+        fuse_qkv_projections = config.getoption("fuse_qkv_projections", True)
+        quantization = config.getoption("quantization", None)
+        enable_vae_tiling = config.getoption("enable_vae_tiling", True)
+        enable_text_cuda_graph = config.getoption("enable_text_cuda_graph", False)
 
         state_dict = None
         if weight_path is None and pretrained_infos is not None:
-            state_dict = [
-                load_weight(
-                    nested_dict_value(pretrained_infos, "unet", "weight"),
-                    prefix_keys={"": "unet."},
-                ),
-                load_weight(
-                    nested_dict_value(pretrained_infos, "text", "weight"),
-                    prefix_keys={"": "text."},
-                ),
-                load_weight(
-                    nested_dict_value(pretrained_infos, "text2", "weight"),
-                    prefix_keys={"": "text2."},
-                ),
-                load_weight(
-                    nested_dict_value(pretrained_infos, "vae", "weight"),
-                    prefix_keys={"": "vae."},
-                ),
+            load_weight_args = [
+                (nested_dict_value(pretrained_infos, "unet", "weight"), "unet."),
+                (nested_dict_value(pretrained_infos, "text", "weight"), "text."),
+                (nested_dict_value(pretrained_infos, "text2", "weight"), "text2."),
+                (nested_dict_value(pretrained_infos, "vae", "weight"), "vae."),
             ]
             if len(pretrained_controlnet_infos) > 1:
                 for i, pretrained_controlnet_info in enumerate(
                     pretrained_controlnet_infos
                 ):
-                    state_dict.append(
-                        load_weight(
+                    load_weight_args.append(
+                        (
                             nested_dict_value(
                                 pretrained_controlnet_info, "controlnet", "weight"
                             ),
-                            prefix_keys={"": f"controlnet.nets.{i}."},
+                            f"controlnet.nets.{i}.",
                         )
                     )
             else:
-                state_dict.append(
-                    load_weight(
+                load_weight_args.append(
+                    (
                         nested_dict_value(
                             pretrained_controlnet_infos[0], "controlnet", "weight"
                         ),
-                        prefix_keys={"": "controlnet."},
+                        "controlnet.",
+                    )
+                )
+            # the checkpoints are independent, download and deserialize them concurrently
+            with ThreadPoolExecutor(max_workers=8) as executor:
+                state_dict = list(
+                    executor.map(
+                        lambda args: load_weight(args[0], prefix_keys={"": args[1]}),
+                        load_weight_args,
                     )
                 )
 
@@ -414,6 +542,10 @@ class ControlNetXLForImageInpaintingFastAPIPipeline(GenericStableXLModel):
             device=device,
             enable_cpu_offload=enable_cpu_offload,
             enable_xformers=enable_xformers,
+            fuse_qkv_projections=fuse_qkv_projections,
+            quantization=quantization,
+            enable_vae_tiling=enable_vae_tiling,
+            enable_text_cuda_graph=enable_text_cuda_graph,
         )
         return inst
 
@@ -471,9 +603,15 @@ class ControlNetXLForImageInpaintingFastAPIPipeline(GenericStableXLModel):
         }
         self.seed = seed
 
-        inputs = {k: v.unsqueeze(0) if v is not None else v for k, v in inputs.items()}
+        # one pass, staged through the cached pinned host allocator so the copies
+        # run asynchronously, the pipeline's first kernels order after them
+        pin_memory = self.device.type == "cuda"
         inputs = {
-            k: v.to(device=self.device) if v is not None else v
+            k: (
+                _stage_input(v.unsqueeze(0), self.device, pin_memory)
+                if v is not None
+                else v
+            )
             for k, v in inputs.items()
         }
 
@@ -511,9 +649,20 @@ class ControlNetXLForImageInpaintingFastAPIPipeline(GenericStableXLModel):
             num_inference_steps=num_timesteps,
             guidance_scale=guidance_scale,
             strength=strength,
-            output_type="np.array",
+            output_type="pt",
         )
 
-        images = torch.from_numpy(outputs.images)
-        images = numpy_to_pil(images.cpu().numpy())
-        return images[0]
+        # numpy has no bfloat16, convert on the device before any host copy
+        images = outputs.images.float().permute(0, 2, 3, 1)
+        if images.device.type != "cuda":
+            return numpy_to_pil(images.numpy())[0]
+
+        # stage the device to host copy through a reused page-locked buffer
+        with self._pinned_lock:
+            if self._pinned_images is None or self._pinned_images.shape != images.shape:
+                self._pinned_images = torch.empty(
+                    images.shape, dtype=torch.float32, pin_memory=True
+                )
+            self._pinned_images.copy_(images, non_blocking=True)
+            torch.cuda.current_stream(images.device).synchronize()
+            return numpy_to_pil(self._pinned_images.numpy())[0]
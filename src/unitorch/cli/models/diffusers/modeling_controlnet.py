@@ -2,6 +2,8 @@
 # Licensed under the MIT License.
 
 import torch
+import logging
+from contextlib import nullcontext
 from typing import Any, Callable, Dict, List, Optional, Set, Tuple, Union
 from torch import autocast
 
@@ -10,7 +12,9 @@ from unitorch.models.diffusers import (
     ControlNetForImage2ImageGeneration as _ControlNetForImage2ImageGeneration,
     ControlNetForImageInpainting as _ControlNetForImageInpainting,
 )
-from unitorch.utils import pop_value, nested_dict_value
+from unitorch.models import QuantizationConfig
+from unitorch.models.quantization import quantize_model
+from unitorch.utils import pop_value, nested_dict_value, suspend_nn_inits
 from unitorch.cli import (
     cached_path,
     add_default_section_for_init,
@@ -19,6 +23,7 @@ from unitorch.cli import (
 )
 from unitorch.cli.models import DiffusionOutputs, LossOutputs
 from unitorch.cli.models import diffusion_model_decorator
+from unitorch.cli.models.diffusion_utils import cache_scheduler_timesteps
 from unitorch.cli.models.diffusers import (
     pretrained_stable_infos,
     pretrained_stable_extensions_infos,
@@ -26,6 +31,156 @@ from unitorch.cli.models.diffusers import (
 )
 
 
+def _quantize_denoisers(inst, config):
+    # only the linear layers are converted, conv_in, conv_out and norms stay as is
+    for name in ("unet", "controlnet"):
+        quantization = config.getoption(f"{name}_quant", None)
+        if quantization is None:
+            continue
+        if quantization == "nf4":
+            quant_config = QuantizationConfig(
+                load_in_4bit=True,
+                bnb_4bit_quant_type="nf4",
+                bnb_4bit_compute_dtype=torch.bfloat16,
+            )
+            quantize_model(getattr(inst, name), quant_config, None)
+        elif quantization == "int8":
+            inst.quantize_int8(modules=[name])
+        elif quantization == "int8_dynamic":
+            # int8 activations too, matmuls run on torch._int_mm, attention stays
+            # in sdpa at the compute dtype
+            inst.quantize_int8_dynamic(modules=[name])
+        elif quantization == "fp8":
+            inst.quantize_float8(modules=[name])
+        else:
+            raise ValueError(f"Unsupported {name} quantization {quantization}.")
+
+
+_DTYPES = {"fp16": torch.float16, "bf16": torch.bfloat16}
+
+
+def _cast_text_encoder(inst, config, freeze_text_encoder: bool):
+    text_dtype = config.getoption("text_dtype", None)
+    if text_dtype is None or not freeze_text_encoder:
+        return
+    if text_dtype not in _DTYPES:
+        raise ValueError(f"Unsupported text encoder dtype {text_dtype}.")
+    # frozen, so the half precision weights never take an optimizer step
+    for name in ("text", "text2"):
+        module = getattr(inst, name, None)
+        if module is not None:
+            module.to(dtype=_DTYPES[text_dtype])
+
+
+def _cast_modules(inst, config, frozen_modules: Dict[str, bool]):
+    torch_dtype = config.getoption("torch_dtype", None)
+    if torch_dtype is None:
+        return
+    if torch_dtype not in _DTYPES:
+        raise ValueError(f"Unsupported dtype {torch_dtype}.")
+    # only frozen modules, trainable ones keep fp32 master weights for the
+    # optimizer and the grad scaler, autocast still runs them in low precision
+    dtype = _DTYPES[torch_dtype]
+    trainable_modules = []
+    for name, frozen in frozen_modules.items():
+        module = getattr(inst, name, None)
+        if module is None:
+            continue
+        if not frozen:
+            trainable_modules.append(name)
+            continue
+        module.to(dtype=dtype)
+    if trainable_modules:
+        names = ", ".join(trainable_modules)
+        logging.warning(f"Skip casting the trainable {names} to {torch_dtype}.")
+    inst.autocast_dtype = dtype
+
+
+def _generate_autocast(inst):
+    dtype = getattr(inst, "autocast_dtype", None)
+    if dtype is None or not torch.cuda.is_available():
+        return nullcontext()
+    return autocast(device_type="cuda", dtype=dtype)
+
+
+def _convert_memory_format(inst, config):
+    if not config.getoption("use_channels_last", False):
+        return
+    # nhwc lets cudnn pick tensor core kernels for the conv heavy modules
+    for module in (inst.unet, inst.controlnet, inst.vae):
+        module.to(memory_format=torch.channels_last)
+
+
+def _compile_modules(inst, config, compile_vae_encode: bool = False):
+    if not torch.cuda.is_available():
+        return
+    compile_unet = config.getoption("compile_unet", False)
+    compile_controlnet = config.getoption("compile_controlnet", False)
+    compile_mode = config.getoption("compile_mode", "reduce-overhead")
+    # use_compile is the one switch for the denoisers and the training helpers,
+    # compile_unet / compile_controlnet pick the modules one by one
+    use_compile = config.getoption("use_compile", False)
+    if use_compile:
+        compile_unet = compile_controlnet = True
+        if hasattr(inst, "_prepare_noisy_latents"):
+            inst._prepare_noisy_latents = torch.compile(inst._prepare_noisy_latents)
+    if config.getoption("use_cuda_graphs", False):
+        # reduce-overhead captures the fixed shape denoise steps as cuda graphs
+        # and copies the new latents into the static inputs on every replay
+        compile_unet = compile_controlnet = True
+        compile_mode = "reduce-overhead"
+    # the first generate call pays the compile warmup, about a minute on sd15,
+    # compile in place to keep state_dict keys unchanged for checkpoints
+    if compile_unet:
+        inst.unet.to(memory_format=torch.channels_last)
+        inst.unet.compile(mode=compile_mode, fullgraph=False)
+    if compile_controlnet:
+        inst.controlnet.to(memory_format=torch.channels_last)
+        inst.controlnet.compile(mode=compile_mode, fullgraph=False)
+
+    if config.getoption("compile_vae", False):
+        inst.vae.to(memory_format=torch.channels_last)
+        inst.vae.decode = torch.compile(inst.vae.decode, mode=compile_mode)
+        if compile_vae_encode:
+            inst.vae.encode = torch.compile(inst.vae.encode, mode=compile_mode)
+
+
+def _enable_vae_memory_options(inst, config):
+    # decode tile by tile and sample by sample to bound the vae peak memory
+    if config.getoption("vae_tiling", False):
+        inst.vae.enable_tiling()
+    if config.getoption("vae_slicing", False):
+        inst.vae.enable_slicing()
+
+
+def _apply_inference_options(
+    inst,
+    config,
+    freeze_text_encoder: bool,
+    freeze_vae_encoder: bool,
+    freeze_unet_encoder: bool,
+    compile_vae_encode: bool = False,
+):
+    # shared by the controlnet and controlnet xl models, quantize before compiling
+    _quantize_denoisers(inst, config)
+    # the controlnet has no freeze option, it is always trained
+    frozen_modules = {
+        "text": freeze_text_encoder,
+        "text2": freeze_text_encoder,
+        "vae": freeze_vae_encoder,
+        "unet": freeze_unet_encoder,
+        "controlnet": False,
+    }
+    _cast_modules(inst, config, frozen_modules)
+    _cast_text_encoder(inst, config, freeze_text_encoder)
+    _convert_memory_format(inst, config)
+    _enable_vae_memory_options(inst, config)
+    # the pipeline shares inst.scheduler, replay its timesteps for repeated calls
+    if config.getoption("cache_scheduler_timesteps", False):
+        cache_scheduler_timesteps(inst.scheduler)
+    _compile_modules(inst, config, compile_vae_encode=compile_vae_encode)
+
+
 @register_model("core/model/diffusers/text2image/controlnet", diffusion_model_decorator)
 class ControlNetForText2ImageGeneration(_ControlNetForText2ImageGeneration):
     def __init__(
@@ -143,25 +298,27 @@ class ControlNetForText2ImageGeneration(_ControlNetForText2ImageGeneration):
         freeze_unet_encoder = config.getoption("freeze_unet_encoder", True)
         snr_gamma = config.getoption("snr_gamma", 5.0)
         seed = config.getoption("seed", 1123)
-
-        inst = cls(
-            config_path=config_path,
-            text_config_path=text_config_path,
-            vae_config_path=vae_config_path,
-            controlnet_configs_path=controlnet_configs_path,
-            scheduler_config_path=scheduler_config_path,
-            quant_config_path=quant_config_path,
-            image_size=image_size,
-            in_channels=in_channels,
-            out_channels=out_channels,
-            num_train_timesteps=num_train_timesteps,
-            num_infer_timesteps=num_infer_timesteps,
-            freeze_vae_encoder=freeze_vae_encoder,
-            freeze_text_encoder=freeze_text_encoder,
-            freeze_unet_encoder=freeze_unet_encoder,
-            snr_gamma=snr_gamma,
-            seed=seed,
-        )
+        skip_init_weights = config.getoption("skip_init_weights", False)
+
+        with suspend_nn_inits() if skip_init_weights else nullcontext():
+            inst = cls(
+                config_path=config_path,
+                text_config_path=text_config_path,
+                vae_config_path=vae_config_path,
+                controlnet_configs_path=controlnet_configs_path,
+                scheduler_config_path=scheduler_config_path,
+                quant_config_path=quant_config_path,
+                image_size=image_size,
+                in_channels=in_channels,
+                out_channels=out_channels,
+                num_train_timesteps=num_train_timesteps,
+                num_infer_timesteps=num_infer_timesteps,
+                freeze_vae_encoder=freeze_vae_encoder,
+                freeze_text_encoder=freeze_text_encoder,
+                freeze_unet_encoder=freeze_unet_encoder,
+                snr_gamma=snr_gamma,
+                seed=seed,
+            )
 
         weight_path = config.getoption("pretrained_weight_path", None)
 
@@ -232,6 +389,14 @@ class ControlNetForText2ImageGeneration(_ControlNetForText2ImageGeneration):
                 save_base_state=False,
             )
 
+        _apply_inference_options(
+            inst,
+            config,
+            freeze_text_encoder,
+            freeze_vae_encoder,
+            freeze_unet_encoder,
+        )
+
         return inst
 
     @autocast(device_type=("cuda" if torch.cuda.is_available() else "cpu"))
@@ -263,22 +428,25 @@ class ControlNetForText2ImageGeneration(_ControlNetForText2ImageGeneration):
         width: Optional[int] = 512,
         guidance_scale: Optional[float] = 7.5,
         controlnet_conditioning_scale: Optional[float] = None,
+        offload_text_encoder: Optional[bool] = False,
     ):
         if controlnet_conditioning_scale is None:
             controlnet_conditioning_scale = (
                 [1.0] * self.num_controlnets if self.num_controlnets > 1 else 1.0
             )
-        outputs = super().generate(
-            input_ids=input_ids,
-            negative_input_ids=negative_input_ids,
-            condition_pixel_values=condition_pixel_values,
-            attention_mask=attention_mask,
-            negative_attention_mask=negative_attention_mask,
-            height=height,
-            width=width,
-            guidance_scale=guidance_scale,
-            controlnet_conditioning_scale=controlnet_conditioning_scale,
-        )
+        with _generate_autocast(self):
+            outputs = super().generate(
+                input_ids=input_ids,
+                negative_input_ids=negative_input_ids,
+                condition_pixel_values=condition_pixel_values,
+                attention_mask=attention_mask,
+                negative_attention_mask=negative_attention_mask,
+                height=height,
+                width=width,
+                guidance_scale=guidance_scale,
+                controlnet_conditioning_scale=controlnet_conditioning_scale,
+                offload_text_encoder=offload_text_encoder,
+            )
 
         return DiffusionOutputs(outputs=outputs.images)
 
@@ -402,25 +570,27 @@ class ControlNetForImage2ImageGeneration(_ControlNetForImage2ImageGeneration):
         freeze_unet_encoder = config.getoption("freeze_unet_encoder", True)
         snr_gamma = config.getoption("snr_gamma", 5.0)
         seed = config.getoption("seed", 1123)
-
-        inst = cls(
-            config_path=config_path,
-            text_config_path=text_config_path,
-            vae_config_path=vae_config_path,
-            controlnet_configs_path=controlnet_configs_path,
-            scheduler_config_path=scheduler_config_path,
-            quant_config_path=quant_config_path,
-            image_size=image_size,
-            in_channels=in_channels,
-            out_channels=out_channels,
-            num_train_timesteps=num_train_timesteps,
-            num_infer_timesteps=num_infer_timesteps,
-            freeze_vae_encoder=freeze_vae_encoder,
-            freeze_text_encoder=freeze_text_encoder,
-            freeze_unet_encoder=freeze_unet_encoder,
-            snr_gamma=snr_gamma,
-            seed=seed,
-        )
+        skip_init_weights = config.getoption("skip_init_weights", False)
+
+        with suspend_nn_inits() if skip_init_weights else nullcontext():
+            inst = cls(
+                config_path=config_path,
+                text_config_path=text_config_path,
+                vae_config_path=vae_config_path,
+                controlnet_configs_path=controlnet_configs_path,
+                scheduler_config_path=scheduler_config_path,
+                quant_config_path=quant_config_path,
+                image_size=image_size,
+                in_channels=in_channels,
+                out_channels=out_channels,
+                num_train_timesteps=num_train_timesteps,
+                num_infer_timesteps=num_infer_timesteps,
+                freeze_vae_encoder=freeze_vae_encoder,
+                freeze_text_encoder=freeze_text_encoder,
+                freeze_unet_encoder=freeze_unet_encoder,
+                snr_gamma=snr_gamma,
+                seed=seed,
+            )
 
         weight_path = config.getoption("pretrained_weight_path", None)
 
@@ -490,6 +660,15 @@ class ControlNetForImage2ImageGeneration(_ControlNetForImage2ImageGeneration):
                 save_base_state=False,
             )
 
+        _apply_inference_options(
+            inst,
+            config,
+            freeze_text_encoder,
+            freeze_vae_encoder,
+            freeze_unet_encoder,
+            compile_vae_encode=True,
+        )
+
         return inst
 
     @autocast(device_type=("cuda" if torch.cuda.is_available() else "cpu"))
@@ -511,18 +690,21 @@ class ControlNetForImage2ImageGeneration(_ControlNetForImage2ImageGeneration):
         strength: Optional[float] = 1.0,
         guidance_scale: Optional[float] = 7.5,
         controlnet_conditioning_scale: Optional[float] = 1.0,
+        offload_text_encoder: Optional[bool] = False,
     ):
-        outputs = super().generate(
-            input_ids=input_ids,
-            negative_input_ids=negative_input_ids,
-            pixel_values=pixel_values,
-            condition_pixel_values=condition_pixel_values,
-            attention_mask=attention_mask,
-            negative_attention_mask=negative_attention_mask,
-            strength=strength,
-            guidance_scale=guidance_scale,
-            controlnet_conditioning_scale=controlnet_conditioning_scale,
-        )
+        with _generate_autocast(self):
+            outputs = super().generate(
+                input_ids=input_ids,
+                negative_input_ids=negative_input_ids,
+                pixel_values=pixel_values,
+                condition_pixel_values=condition_pixel_values,
+                attention_mask=attention_mask,
+                negative_attention_mask=negative_attention_mask,
+                strength=strength,
+                guidance_scale=guidance_scale,
+                controlnet_conditioning_scale=controlnet_conditioning_scale,
+                offload_text_encoder=offload_text_encoder,
+            )
         return DiffusionOutputs(outputs=outputs.images)
 
 
@@ -674,28 +856,30 @@ class ControlNetForImageInpainting(_ControlNetForImageInpainting):
         freeze_unet_encoder = config.getoption("freeze_unet_encoder", True)
         snr_gamma = config.getoption("snr_gamma", 5.0)
         seed = config.getoption("seed", 1123)
-
-        inst = cls(
-            config_path=config_path,
-            text_config_path=text_config_path,
-            vae_config_path=vae_config_path,
-            scheduler_config_path=scheduler_config_path,
-            controlnet_configs_path=controlnet_configs_path
-            if len(controlnet_configs_path) > 0
-            else None,
-            inpainting_controlnet_config_path=inpainting_controlnet_config_path,
-            quant_config_path=quant_config_path,
-            image_size=image_size,
-            in_channels=in_channels,
-            out_channels=out_channels,
-            num_train_timesteps=num_train_timesteps,
-            num_infer_timesteps=num_infer_timesteps,
-            freeze_vae_encoder=freeze_vae_encoder,
-            freeze_text_encoder=freeze_text_encoder,
-            freeze_unet_encoder=freeze_unet_encoder,
-            snr_gamma=snr_gamma,
-            seed=seed,
-        )
+        skip_init_weights = config.getoption("skip_init_weights", False)
+
+        with suspend_nn_inits() if skip_init_weights else nullcontext():
+            inst = cls(
+                config_path=config_path,
+                text_config_path=text_config_path,
+                vae_config_path=vae_config_path,
+                scheduler_config_path=scheduler_config_path,
+                controlnet_configs_path=controlnet_configs_path
+                if len(controlnet_configs_path) > 0
+                else None,
+                inpainting_controlnet_config_path=inpainting_controlnet_config_path,
+                quant_config_path=quant_config_path,
+                image_size=image_size,
+                in_channels=in_channels,
+                out_channels=out_channels,
+                num_train_timesteps=num_train_timesteps,
+                num_infer_timesteps=num_infer_timesteps,
+                freeze_vae_encoder=freeze_vae_encoder,
+                freeze_text_encoder=freeze_text_encoder,
+                freeze_unet_encoder=freeze_unet_encoder,
+                snr_gamma=snr_gamma,
+                seed=seed,
+            )
 
         weight_path = config.getoption("pretrained_weight_path", None)
 
@@ -764,6 +948,15 @@ class ControlNetForImageInpainting(_ControlNetForImageInpainting):
                 save_base_state=False,
             )
 
+        _apply_inference_options(
+            inst,
+            config,
+            freeze_text_encoder,
+            freeze_vae_encoder,
+            freeze_unet_encoder,
+            compile_vae_encode=True,
+        )
+
         return inst
 
     @autocast(device_type=("cuda" if torch.cuda.is_available() else "cpu"))
@@ -802,19 +995,22 @@ class ControlNetForImageInpainting(_ControlNetForImageInpainting):
         guidance_scale: Optional[float] = 7.5,
         controlnet_conditioning_scale: Optional[Union[float, List[float]]] = None,
         inpainting_controlnet_conditioning_scale: Optional[float] = None,
+        offload_text_encoder: Optional[bool] = False,
     ):
-        outputs = super().generate(
-            input_ids=input_ids,
-            negative_input_ids=negative_input_ids,
-            pixel_values=pixel_values,
-            pixel_masks=pixel_masks,
-            condition_pixel_values=condition_pixel_values,
-            inpainting_condition_pixel_values=inpainting_condition_pixel_values,
-            attention_mask=attention_mask,
-            negative_attention_mask=negative_attention_mask,
-            strength=strength,
-            guidance_scale=guidance_scale,
-            controlnet_conditioning_scale=controlnet_conditioning_scale,
-            inpainting_controlnet_conditioning_scale=inpainting_controlnet_conditioning_scale,
-        )
+        with _generate_autocast(self):
+            outputs = super().generate(
+                input_ids=input_ids,
+                negative_input_ids=negative_input_ids,
+                pixel_values=pixel_values,
+                pixel_masks=pixel_masks,
+                condition_pixel_values=condition_pixel_values,
+                inpainting_condition_pixel_values=inpainting_condition_pixel_values,
+                attention_mask=attention_mask,
+                negative_attention_mask=negative_attention_mask,
+                strength=strength,
+                guidance_scale=guidance_scale,
+                controlnet_conditioning_scale=controlnet_conditioning_scale,
+                inpainting_controlnet_conditioning_scale=inpainting_controlnet_conditioning_scale,
+                offload_text_encoder=offload_text_encoder,
+            )
         return DiffusionOutputs(outputs=outputs.images)
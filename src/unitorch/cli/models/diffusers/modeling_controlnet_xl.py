@@ -29,6 +29,7 @@ from unitorch.cli.models.diffusers import (
     pretrained_stable_extensions_infos,
     load_weight,
 )
+from unitorch.cli.models.diffusers.modeling_controlnet import _apply_inference_options
 
 
 @register_model(
@@ -269,6 +270,14 @@ class ControlNetXLForText2ImageGeneration(_ControlNetXLForText2ImageGeneration):
                 save_base_state=False,
             )
 
+        _apply_inference_options(
+            inst,
+            config,
+            freeze_text_encoder,
+            freeze_vae_encoder,
+            freeze_unet_encoder,
+        )
+
         return inst
 
     def forward(
@@ -311,7 +320,7 @@ class ControlNetXLForText2ImageGeneration(_ControlNetXLForText2ImageGeneration):
     ):
         with autocast(
             device_type=("cuda" if torch.cuda.is_available() else "cpu"),
-            dtype=self.use_dtype,
+            dtype=getattr(self, "autocast_dtype", self.use_dtype),
         ):
             outputs = super().generate(
                 input_ids=input_ids,
@@ -566,6 +575,15 @@ class ControlNetXLForImage2ImageGeneration(_ControlNetXLForImage2ImageGeneration
                 save_base_state=False,
             )
 
+        _apply_inference_options(
+            inst,
+            config,
+            freeze_text_encoder,
+            freeze_vae_encoder,
+            freeze_unet_encoder,
+            compile_vae_encode=True,
+        )
+
         return inst
 
     def forward(
@@ -592,7 +610,7 @@ class ControlNetXLForImage2ImageGeneration(_ControlNetXLForImage2ImageGeneration
     ):
         with autocast(
             device_type=("cuda" if torch.cuda.is_available() else "cpu"),
-            dtype=self.use_dtype,
+            dtype=getattr(self, "autocast_dtype", self.use_dtype),
         ):
             outputs = super().generate(
                 input_ids=input_ids,
@@ -885,6 +903,15 @@ class ControlNetXLForImageInpainting(_ControlNetXLForImageInpainting):
                 save_base_state=False,
             )
 
+        _apply_inference_options(
+            inst,
+            config,
+            freeze_text_encoder,
+            freeze_vae_encoder,
+            freeze_unet_encoder,
+            compile_vae_encode=True,
+        )
+
         return inst
 
     def forward(
@@ -936,7 +963,7 @@ class ControlNetXLForImageInpainting(_ControlNetXLForImageInpainting):
     ):
         with autocast(
             device_type=("cuda" if torch.cuda.is_available() else "cpu"),
-            dtype=self.use_dtype,
+            dtype=getattr(self, "autocast_dtype", self.use_dtype),
         ):
             outputs = super().generate(
                 input_ids=input_ids,
@@ -3,6 +3,7 @@
 
 import os
 import re
+import copy
 import io
 import torch
 import torch.nn as nn
@@ -29,6 +30,36 @@ from unitorch.cli.models.modeling_utils import TensorsOutputs, TensorsTargets
 from unitorch.cli import cached_path
 
 
+def cache_scheduler_timesteps(scheduler):
+    # set_timesteps rebuilds the same schedule in numpy on every call,
+    # replay a snapshot of the scheduler state for repeated step counts
+    set_timesteps = scheduler.set_timesteps
+    snapshots = dict()
+
+    def _restore(snapshot):
+        # fresh lists each time, schedulers fill them in place while stepping
+        for key, value in snapshot.items():
+            if isinstance(value, list):
+                value = copy.copy(value)
+            setattr(scheduler, key, value)
+
+    def cached_set_timesteps(num_inference_steps=None, device=None, **kwargs):
+        if kwargs:
+            return set_timesteps(num_inference_steps, device=device, **kwargs)
+        key = (num_inference_steps, str(device))
+        if key not in snapshots:
+            set_timesteps(num_inference_steps, device=device)
+            snapshots[key] = {
+                k: copy.copy(v) if isinstance(v, list) else v
+                for k, v in scheduler.__dict__.items()
+                if k != "set_timesteps"
+            }
+        else:
+            _restore(snapshots[key])
+
+    scheduler.set_timesteps = cached_set_timesteps
+
+
 def numpy2vid(video, mean=[0.5, 0.5, 0.5], std=[0.5, 0.5, 0.5]):
     batch_size, channels, num_frames, height, width = video.shape
     mean = np.array(mean).reshape(1, -1, 1, 1, 1)
@@ -153,7 +184,7 @@ class DiffusionProcessor:
     ):
         results = outputs.to_pandas()
         assert results.shape[0] == 0 or results.shape[0] == outputs.outputs.shape[0]
-        images = outputs.outputs.numpy()
+        images = outputs.outputs.float().numpy()
         images = numpy_to_pil(images)
         results["diffusion"] = [self.save_image(image) for image in images]
         return WriterOutputs(results)
@@ -165,7 +196,7 @@ class DiffusionProcessor:
     ):
         results = outputs.to_pandas()
         assert results.shape[0] == 0 or results.shape[0] == outputs.outputs.shape[0]
-        images = outputs.outputs.numpy()
+        images = outputs.outputs.float().numpy()
         images = [numpy_to_pil(image) for image in images]
         results["diffusion"] = [self.save_gif(image) for image in images]
         return WriterOutputs(results)
@@ -177,7 +208,7 @@ class DiffusionProcessor:
     ):
         results = outputs.to_pandas()
         assert results.shape[0] == 0 or results.shape[0] == outputs.outputs.shape[0]
-        videos = outputs.outputs.numpy()
+        videos = outputs.outputs.float().numpy()
         videos = [numpy2vid(video) for video in videos]
         results["diffusion"] = [self.save_video(video) for video in videos]
         return WriterOutputs(results)
@@ -395,6 +395,14 @@ class TensorsInputs(ModelInputs, TensorsMixin):
     def __init__(self, inputs: Optional[Dict] = dict(), **kwargs):
         TensorsMixin.__init__(self, tensors=inputs, **kwargs)
 
+    @classmethod
+    def from_outputs(cls, outputs, field_map: Dict[str, str]):
+        # processor outputs are already tensors, skip the per-tensor checks in __init__
+        inputs = cls.__new__(cls)
+        inputs.__tensors__ = {key: outputs[name] for key, name in field_map.items()}
+        inputs.__dict__.update(inputs.__tensors__)
+        return inputs
+
     def cpu(self, inplace=False):
         results = TensorsMixin.cpu(self, inplace=inplace)
         if inplace:
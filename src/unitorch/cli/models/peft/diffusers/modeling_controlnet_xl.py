@@ -1,9 +1,11 @@
 # Copyright (c) FULIUCANSHENG.
 # Licensed under the MIT License.
 
+import gc
 import torch
-from typing import Any, Callable, Dict, List, Optional, Set, Tuple, Union
-from torch import autocast
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import List, Optional, Union
 
 from unitorch.models.peft.diffusers import (
     ControlNetXLLoraForText2ImageGeneration as _ControlNetXLLoraForText2ImageGeneration,
@@ -15,7 +17,7 @@ from unitorch.utils import (
     is_cuda_available,
 )
 from unitorch.cli import (
-    cached_path,
+    cached_paths,
     add_default_section_for_init,
     add_default_section_for_function,
     register_model,
@@ -29,6 +31,155 @@ from unitorch.cli.models.diffusers import (
 )
 
 
+@lru_cache(maxsize=64)
+def _cached_paths(urls_or_filenames):
+    return tuple(cached_paths(list(urls_or_filenames)))
+
+
+def _flatten_infos(infos, prefix=""):
+    flat_infos = dict()
+    for key, value in infos.items():
+        if isinstance(value, dict):
+            flat_infos.update(_flatten_infos(value, f"{prefix}{key}."))
+        else:
+            flat_infos[f"{prefix}{key}"] = value
+    return flat_infos
+
+
+# pretrained infos flattened to dotted keys, e.g. {"unet.config": ..., "scheduler": ...}
+@lru_cache(maxsize=64)
+def _pretrained_stable_infos(pretrained_name):
+    infos = nested_dict_value(pretrained_stable_infos, pretrained_name)
+    return _flatten_infos(infos) if infos is not None else dict()
+
+
+@lru_cache(maxsize=64)
+def _pretrained_stable_extensions_infos(pretrained_name):
+    infos = nested_dict_value(pretrained_stable_extensions_infos, pretrained_name)
+    return _flatten_infos(infos) if infos is not None else dict()
+
+
+_CONTROLNET_XL_LORA_TARGET_MODULES = [
+    "to_k",
+    "to_q",
+    "to_v",
+    "to_out.0",
+    "q_proj",
+    "v_proj",
+    "out_proj",
+]
+
+_CONTROLNET_XL_LORA_REPLACE_KEYS = {
+    "to_k.": "to_k.base_layer.",
+    "to_q.": "to_q.base_layer.",
+    "to_v.": "to_v.base_layer.",
+    "to_out.0.": "to_out.0.base_layer.",
+    "q_proj.": "q_proj.base_layer.",
+    "v_proj.": "v_proj.base_layer.",
+    "out_proj.": "out_proj.base_layer.",
+}
+
+
+def _rewrite_controlnet_xl_lora_key(key):
+    # literal replaces in order, the keys hold no regex specials besides "."
+    for old, new in _CONTROLNET_XL_LORA_REPLACE_KEYS.items():
+        key = key.replace(old, new)
+    return key
+
+
+def _rewrite_weight_kwargs(prefix_keys, replace_keys):
+    if replace_keys == _CONTROLNET_XL_LORA_REPLACE_KEYS:
+        return dict(
+            prefix_keys=prefix_keys,
+            replace_keys={},
+            rewrite_key=_rewrite_controlnet_xl_lora_key,
+        )
+    return dict(prefix_keys=prefix_keys, replace_keys=replace_keys)
+
+
+@lru_cache(maxsize=8)
+def _cached_load_weight(path, prefix_keys, replace_keys):
+    state_dict = load_weight(
+        list(path) if isinstance(path, tuple) else path,
+        **_rewrite_weight_kwargs(dict(prefix_keys), dict(replace_keys)),
+    )
+    # keep the cached value immutable, callers build their own dict
+    return tuple(state_dict.items())
+
+
+def _load_weight(path, prefix_keys, replace_keys, use_cache: Optional[bool] = False):
+    if not use_cache:
+        return load_weight(path, **_rewrite_weight_kwargs(prefix_keys, replace_keys))
+    return dict(
+        _cached_load_weight(
+            tuple(path) if isinstance(path, list) else path,
+            tuple(prefix_keys.items()),
+            tuple(replace_keys.items()),
+        )
+    )
+
+
+def _load_controlnet_xl_lora_state_dict(
+    pretrained_infos,
+    pretrained_controlnet_infos,
+    replace_keys,
+    enable_text_adapter: Optional[bool] = True,
+    enable_unet_adapter: Optional[bool] = True,
+    use_cache: Optional[bool] = False,
+):
+    load_weight_args = [
+        (
+            pretrained_infos.get("unet.weight"),
+            {"": "unet."},
+            replace_keys if enable_unet_adapter else {},
+        ),
+        (
+            pretrained_infos.get("text.weight"),
+            {"": "text."},
+            replace_keys if enable_text_adapter else {},
+        ),
+        (
+            pretrained_infos.get("text2.weight"),
+            {"": "text2."},
+            replace_keys if enable_text_adapter else {},
+        ),
+        (
+            pretrained_infos.get("vae.weight"),
+            {"": "vae."},
+            {},
+        ),
+        (
+            pretrained_controlnet_infos.get("controlnet.weight"),
+            {"": "controlnet."},
+            {},
+        ),
+    ]
+    with ThreadPoolExecutor(max_workers=len(load_weight_args)) as executor:
+        futures = [
+            executor.submit(
+                _load_weight,
+                path,
+                prefix_keys=prefix_keys,
+                replace_keys=weight_replace_keys,
+                use_cache=use_cache,
+            )
+            for path, prefix_keys, weight_replace_keys in load_weight_args
+        ]
+        # prefix_keys namespace each component, so the merge is collision free
+        state_dict = dict()
+        for future in futures:
+            state_dict.update(future.result())
+        return state_dict
+
+
+def _release_load_state(state_dict):
+    # drop the loaded tensors now instead of when from_core_configure returns
+    state_dict.clear()
+    gc.collect()
+    if torch.cuda.is_available():
+        torch.cuda.empty_cache()
+
+
 @register_model(
     "core/model/diffusers/peft/lora/text2image/controlnet_xl", diffusion_model_decorator
 )
@@ -65,7 +216,8 @@ class ControlNetXLLoraForText2ImageGeneration(_ControlNetXLLoraForText2ImageGene
         enable_unet_adapter: Optional[bool] = True,
         seed: Optional[int] = 1123,
         use_fp16: Optional[bool] = True,
-        use_bf16: Optional[bool] = False,
+        use_bf16: Optional[bool] = True,
+        use_compile: Optional[bool] = False,
     ):
         super().__init__(
             config_path=config_path,
@@ -90,10 +242,14 @@ class ControlNetXLLoraForText2ImageGeneration(_ControlNetXLLoraForText2ImageGene
             enable_unet_adapter=enable_unet_adapter,
             seed=seed,
         )
+        self.use_device = "cuda" if is_cuda_available() else "cpu"
         self.use_dtype = torch.float16 if use_fp16 else torch.float32
         self.use_dtype = (
             torch.bfloat16 if use_bf16 and is_bfloat16_available() else self.use_dtype
         )
+        if use_compile:
+            self.unet.compile(mode="max-autotune", dynamic=False)
+            self.controlnet.compile(mode="max-autotune", dynamic=False)
 
     @classmethod
     @add_default_section_for_init(
@@ -104,60 +260,72 @@ class ControlNetXLLoraForText2ImageGeneration(_ControlNetXLLoraForText2ImageGene
             "core/model/diffusers/peft/lora/text2image/controlnet_xl"
         )
         pretrained_name = config.getoption("pretrained_name", "stable-xl-base")
-        pretrained_infos = nested_dict_value(pretrained_stable_infos, pretrained_name)
+        pretrained_infos = _pretrained_stable_infos(pretrained_name)
 
         config_path = config.getoption("config_path", None)
         config_path = pop_value(
             config_path,
-            nested_dict_value(pretrained_infos, "unet", "config"),
+            pretrained_infos.get("unet.config"),
         )
-        config_path = cached_path(config_path)
 
         text_config_path = config.getoption("text_config_path", None)
         text_config_path = pop_value(
             text_config_path,
-            nested_dict_value(pretrained_infos, "text", "config"),
+            pretrained_infos.get("text.config"),
         )
-        text_config_path = cached_path(text_config_path)
 
         text2_config_path = config.getoption("text2_config_path", None)
         text2_config_path = pop_value(
             text2_config_path,
-            nested_dict_value(pretrained_infos, "text2", "config"),
+            pretrained_infos.get("text2.config"),
         )
-        text2_config_path = cached_path(text2_config_path)
 
         vae_config_path = config.getoption("vae_config_path", None)
         vae_config_path = pop_value(
             vae_config_path,
-            nested_dict_value(pretrained_infos, "vae", "config"),
+            pretrained_infos.get("vae.config"),
         )
-        vae_config_path = cached_path(vae_config_path)
 
         pretrained_controlnet_name = config.getoption(
             "pretrained_controlnet_name", "stable-xl-controlnet-canny"
         )
-        pretrained_controlnet_infos = nested_dict_value(
-            pretrained_stable_extensions_infos, pretrained_controlnet_name
+        pretrained_controlnet_infos = _pretrained_stable_extensions_infos(
+            pretrained_controlnet_name
         )
 
         controlnet_configs_path = config.getoption("controlnet_configs_path", None)
         controlnet_configs_path = pop_value(
             controlnet_configs_path,
-            nested_dict_value(pretrained_controlnet_infos, "controlnet", "config"),
+            pretrained_controlnet_infos.get("controlnet.config"),
         )
-        controlnet_configs_path = cached_path(controlnet_configs_path)
 
         scheduler_config_path = config.getoption("scheduler_config_path", None)
         scheduler_config_path = pop_value(
             scheduler_config_path,
-            nested_dict_value(pretrained_infos, "scheduler"),
+            pretrained_infos.get("scheduler"),
         )
-        scheduler_config_path = cached_path(scheduler_config_path)
 
         quant_config_path = config.getoption("quant_config_path", None)
-        if quant_config_path is not None:
-            quant_config_path = cached_path(quant_config_path)
+
+        (
+            config_path,
+            text_config_path,
+            text2_config_path,
+            vae_config_path,
+            controlnet_configs_path,
+            scheduler_config_path,
+            quant_config_path,
+        ) = _cached_paths(
+            (
+                config_path,
+                text_config_path,
+                text2_config_path,
+                vae_config_path,
+                controlnet_configs_path,
+                scheduler_config_path,
+                quant_config_path,
+            )
+        )
 
         image_size = config.getoption("image_size", None)
         in_channels = config.getoption("in_channels", None)
@@ -170,35 +338,18 @@ class ControlNetXLLoraForText2ImageGeneration(_ControlNetXLLoraForText2ImageGene
         lora_dropout = config.getoption("lora_dropout", 0.05)
         fan_in_fan_out = config.getoption("fan_in_fan_out", True)
         target_modules = config.getoption(
-            "target_modules",
-            [
-                "to_k",
-                "to_q",
-                "to_v",
-                "to_out.0",
-                "q_proj",
-                "v_proj",
-                "out_proj",
-            ],
+            "target_modules", _CONTROLNET_XL_LORA_TARGET_MODULES
         )
         replace_keys = config.getoption(
-            "replace_keys",
-            {
-                "to_k.": "to_k.base_layer.",
-                "to_q.": "to_q.base_layer.",
-                "to_v.": "to_v.base_layer.",
-                "to_out.0.": "to_out.0.base_layer.",
-                "q_proj.": "q_proj.base_layer.",
-                "v_proj.": "v_proj.base_layer.",
-                "out_proj.": "out_proj.base_layer.",
-            },
+            "replace_keys", _CONTROLNET_XL_LORA_REPLACE_KEYS
         )
         enable_text_adapter = config.getoption("enable_text_adapter", True)
         enable_unet_adapter = config.getoption("enable_unet_adapter", True)
 
         seed = config.getoption("seed", 1123)
         use_fp16 = config.getoption("use_fp16", True)
-        use_bf16 = config.getoption("use_bf16", False)
+        use_bf16 = config.getoption("use_bf16", True)
+        use_compile = config.getoption("use_compile", False)
 
         inst = cls(
             config_path=config_path,
@@ -224,39 +375,21 @@ class ControlNetXLLoraForText2ImageGeneration(_ControlNetXLLoraForText2ImageGene
             seed=seed,
             use_fp16=use_fp16,
             use_bf16=use_bf16,
+            use_compile=use_compile,
         )
 
         weight_path = config.getoption("pretrained_weight_path", None)
 
         state_dict = None
-        if weight_path is None and pretrained_infos is not None:
-            state_dict = [
-                load_weight(
-                    nested_dict_value(pretrained_infos, "unet", "weight"),
-                    prefix_keys={"": "unet."},
-                    replace_keys=replace_keys if enable_unet_adapter else {},
-                ),
-                load_weight(
-                    nested_dict_value(pretrained_infos, "text", "weight"),
-                    prefix_keys={"": "text."},
-                    replace_keys=replace_keys if enable_text_adapter else {},
-                ),
-                load_weight(
-                    nested_dict_value(pretrained_infos, "text2", "weight"),
-                    prefix_keys={"": "text2."},
-                    replace_keys=replace_keys if enable_text_adapter else {},
-                ),
-                load_weight(
-                    nested_dict_value(pretrained_infos, "vae", "weight"),
-                    prefix_keys={"": "vae."},
-                ),
-                load_weight(
-                    nested_dict_value(
-                        pretrained_controlnet_infos, "controlnet", "weight"
-                    ),
-                    prefix_keys={"": "controlnet."},
-                ),
-            ]
+        if weight_path is None and pretrained_infos:
+            state_dict = _load_controlnet_xl_lora_state_dict(
+                pretrained_infos,
+                pretrained_controlnet_infos,
+                replace_keys=replace_keys,
+                enable_text_adapter=enable_text_adapter,
+                enable_unet_adapter=enable_unet_adapter,
+                use_cache=config.getoption("cache_pretrained_weights", False),
+            )
         elif weight_path is not None:
             state_dict = load_weight(weight_path)
 
@@ -266,12 +399,34 @@ class ControlNetXLLoraForText2ImageGeneration(_ControlNetXLLoraForText2ImageGene
         if pretrained_lora_weight_path is not None:
             lora_state_dict = load_weight(pretrained_lora_weight_path)
             if state_dict is not None:
-                state_dict.append(lora_state_dict)
+                state_dict.update(lora_state_dict)
             else:
                 state_dict = lora_state_dict
 
         if state_dict is not None:
             inst.from_pretrained(state_dict=state_dict)
+            _release_load_state(state_dict)
+            del state_dict
+
+        # fuse after loading so the fused projections carry the pretrained weights;
+        # the unet is skipped while its lora adapters wrap to_q/to_k/to_v
+        if config.getoption("fuse_qkv_projections", False):
+            fuse_modules = [inst.vae, inst.controlnet]
+            if not enable_unet_adapter:
+                fuse_modules.append(inst.unet)
+            for module in fuse_modules:
+                if hasattr(module, "fuse_qkv_projections"):
+                    module.fuse_qkv_projections()
+
+        quantization = config.getoption("quantization", None)
+        if quantization == "fp8_e4m3":
+            inst.quantize_float8(modules=["unet", "controlnet"])
+        elif quantization is not None:
+            raise ValueError(f"Unsupported quantization {quantization}.")
+
+        # vae decode and prompt encoding are memory bound, int8 halves weight traffic
+        if config.getoption("vae_int8", False):
+            inst.quantize_int8(modules=["vae", "text", "text2"])
 
         return inst
 
@@ -285,10 +440,7 @@ class ControlNetXLLoraForText2ImageGeneration(_ControlNetXLLoraForText2ImageGene
         attention_mask: Optional[torch.Tensor] = None,
         attention2_mask: Optional[torch.Tensor] = None,
     ):
-        with autocast(
-            device_type=("cuda" if torch.cuda.is_available() else "cpu"),
-            dtype=self.use_dtype,
-        ):
+        with torch.autocast(device_type=self.use_device, dtype=self.use_dtype):
             loss = super().forward(
                 input_ids=input_ids,
                 input2_ids=input2_ids,
@@ -314,11 +466,10 @@ class ControlNetXLLoraForText2ImageGeneration(_ControlNetXLLoraForText2ImageGene
         width: Optional[int] = 1024,
         guidance_scale: Optional[float] = 7.5,
         controlnet_conditioning_scale: Optional[float] = 0.5,
+        lora_patch_step: Optional[int] = None,
+        controlnet_cache_interval: Optional[int] = None,
     ):
-        with autocast(
-            device_type=("cuda" if torch.cuda.is_available() else "cpu"),
-            dtype=self.use_dtype,
-        ):
+        with torch.autocast(device_type=self.use_device, dtype=self.use_dtype):
             outputs = super().generate(
                 input_ids=input_ids,
                 negative_input_ids=negative_input_ids,
@@ -329,6 +480,8 @@ class ControlNetXLLoraForText2ImageGeneration(_ControlNetXLLoraForText2ImageGene
                 width=width,
                 guidance_scale=guidance_scale,
                 controlnet_conditioning_scale=controlnet_conditioning_scale,
+                lora_patch_step=lora_patch_step,
+                controlnet_cache_interval=controlnet_cache_interval,
             )
 
             return DiffusionOutputs(outputs=outputs.images)
@@ -2,9 +2,15 @@
 # Licensed under the MIT License.
 
 import torch
+import fnmatch
+import logging
+from contextlib import nullcontext
+from dataclasses import dataclass
+from functools import lru_cache, partial
+from torch.utils.checkpoint import checkpoint
 from typing import Any, Callable, Dict, List, Optional, Set, Tuple, Union
-from torch import autocast
-from unitorch.utils import pop_value, nested_dict_value
+from unitorch.utils import pop_value, nested_dict_value, load_weight
+from unitorch.models.quantization import quantize_model_float8, quantize_model_int8
 from unitorch.models.siglip import (
     SiglipForPretrain as _SiglipForPretrain,
     SiglipForClassification as _SiglipForClassification,
@@ -22,16 +28,200 @@ from unitorch.cli.models import ClassificationOutputs, LossOutputs
 from unitorch.cli.models.siglip import pretrained_siglip_infos
 
 
+@lru_cache(maxsize=256)
+def _cached_path(url_or_filename):
+    return cached_path(url_or_filename)
+
+
+@lru_cache(maxsize=64)
+def _siglip_info(pretrained_name, key):
+    return nested_dict_value(pretrained_siglip_infos, pretrained_name, key)
+
+
+@dataclass(frozen=True)
+class _SiglipPaths:
+    __slots__ = ("config_path", "weight_path")
+    config_path: str
+    weight_path: Optional[Union[str, List[str]]]
+
+
+def _resolve_siglip_paths(config, pretrained_name):
+    config_path = config.getoption("config_path", None)
+    config_path = pop_value(
+        config_path,
+        _siglip_info(pretrained_name, "config"),
+    )
+    pretrained_weight_path = config.getoption("pretrained_weight_path", None)
+    weight_path = pop_value(
+        pretrained_weight_path,
+        _siglip_info(pretrained_name, "weight"),
+        check_none=False,
+    )
+    return _SiglipPaths(
+        config_path=_cached_path(config_path),
+        weight_path=weight_path,
+    )
+
+
+# pretrained state dicts shared by siglip heads built from the same weights
+_WEIGHT_CACHE = dict()
+
+
+def _load_cached_weight(weight_path):
+    key = tuple(weight_path) if isinstance(weight_path, list) else weight_path
+    if key not in _WEIGHT_CACHE:
+        _WEIGHT_CACHE[key] = load_weight(weight_path)
+    return _WEIGHT_CACHE[key]
+
+
+_DEVICE_TYPE = "cuda" if torch.cuda.is_available() else "cpu"
+
+
+@lru_cache(maxsize=None)
+def _autocast_dtype(device_type, mixed_precision):
+    if mixed_precision == "fp32":
+        return torch.float32
+    if device_type == "cuda":
+        # bf16 keeps the fp32 exponent range, so no grad scaler is needed
+        if mixed_precision == "bf16" and torch.cuda.is_bf16_supported():
+            return torch.bfloat16
+        return torch.float16
+    return torch.bfloat16
+
+
+def _default_gradient_checkpointing(pretrained_name):
+    # large/so400m towers: checkpointing trades ~10-15% extra compute for 33-50%
+    # less activation memory, which usually pays back through a 2x larger batch
+    return any(
+        fnmatch.fnmatch(pretrained_name, pattern)
+        for pattern in ["siglip-large*", "siglip-so400m*"]
+    )
+
+
+def _enable_gradient_checkpointing(model):
+    # non-reentrant checkpointing composes with torch.compile and FSDP
+    checkpoint_func = partial(checkpoint, use_reentrant=False)
+    # the hf encoders (and the encoder layers on newer transformers) start with
+    # the flag off, turn it on wherever it exists
+    for module in model.modules():
+        if isinstance(getattr(module, "gradient_checkpointing", None), bool):
+            module.gradient_checkpointing = True
+            module._gradient_checkpointing_func = checkpoint_func
+
+
+def _quantize_model(model, quantization, freeze_base_model):
+    if not freeze_base_model:
+        logging.warning(
+            f"{quantization} quantization needs freeze_base_model, skip it."
+        )
+        return
+    # only the frozen towers are quantized, heads and logit scale/bias stay as is
+    modules = ["text_model", "vision_model"]
+    if quantization == "fp8":
+        if not torch.cuda.is_available() or torch.cuda.get_device_capability() < (9, 0):
+            logging.warning("fp8 quantization needs sm_90 or newer, skip it.")
+            return
+        quantize_model_float8(model, modules=modules)
+    elif quantization == "int8":
+        quantize_model_int8(model, modules=modules)
+    else:
+        raise ValueError(f"Unsupported quantization {quantization} for siglip.")
+
+
+def _drop_full_attention_mask(attention_mask):
+    # an all-ones mask is a no-op, passing None lets attention skip the mask loads
+    if attention_mask is not None and bool(attention_mask.all()):
+        return None
+    return attention_mask
+
+
+def _inference_mode():
+    # no autograd bookkeeping at all when the caller already disabled grad
+    if torch.is_grad_enabled():
+        return nullcontext()
+    return torch.inference_mode()
+
+
+def _compile_tail(func):
+    # fuse the small similarity/loss ops so the intermediates stay on chip
+    if torch.cuda.is_available():
+        return torch.compile(func, mode="max-autotune")
+    try:
+        return torch.jit.script(func)
+    except Exception:
+        logging.warning(f"Can't script {func.__name__}, keep it in eager mode.")
+        return func
+
+
+def _compile_model(model):
+    import torch._inductor.config as inductor_config
+
+    # reuse compiled graphs across processes instead of recompiling per worker
+    inductor_config.fx_graph_cache = True
+    model.compile(mode="reduce-overhead", dynamic=False)
+
+
+class _SiglipForwardMixin:
+    """Shared autocast forward for the siglip cli models."""
+
+    _output_cls = ClassificationOutputs
+    _output_key = "outputs"
+    _use_inference_mode = True
+    _optional_inputs = ("attention_mask", "position_ids")
+
+    def forward(self, **kwargs):
+        """
+        Perform a forward pass through the model under autocast.
+
+        Args:
+            **kwargs: The inputs of the wrapped siglip model. Attention mask and
+                position ids default to None when the model accepts them.
+
+        Returns:
+            The outputs wrapped in `_output_cls`.
+        """
+        for key in self._optional_inputs:
+            kwargs.setdefault(key, None)
+        if "attention_mask" in kwargs:
+            kwargs["attention_mask"] = _drop_full_attention_mask(
+                kwargs["attention_mask"]
+            )
+        pixel_values = kwargs.get("pixel_values")
+        if (
+            self.use_device == "cuda"
+            and pixel_values is not None
+            and pixel_values.dim() == 4
+        ):
+            # nhwc lets cudnn pick tensor-core kernels for the patch embedding conv
+            kwargs["pixel_values"] = pixel_values.contiguous(
+                memory_format=torch.channels_last
+            )
+        with torch.autocast(
+            device_type=self.use_device,
+            dtype=self.use_dtype,
+            enabled=self.use_dtype != torch.float32,
+        ), (
+            _inference_mode() if self._use_inference_mode else nullcontext()
+        ):
+            outputs = super().forward(**kwargs)
+            return self._output_cls(**{self._output_key: outputs})
+
+
 @register_model("core/model/pretrain/siglip")
-class SiglipForPretrain(_SiglipForPretrain):
+class SiglipForPretrain(_SiglipForwardMixin, _SiglipForPretrain):
     """CLIP model for pretraining."""
 
+    _output_cls = LossOutputs
+    _output_key = "loss"
+    _use_inference_mode = False
+
     def __init__(
         self,
         config_path: str,
         freeze_base_model: Optional[bool] = True,
         gradient_checkpointing: Optional[bool] = False,
         use_all_gather: Optional[bool] = True,
+        mixed_precision: Optional[str] = "bf16",
     ):
         """
         Initialize the SiglipForPretrain model.
@@ -42,6 +232,7 @@ class SiglipForPretrain(_SiglipForPretrain):
             freeze_base_model (bool, optional): Whether to freeze the base model. Defaults to True.
             gradient_checkpointing (bool, optional): Whether to use gradient checkpointing. Defaults to False.
             use_all_gather (bool, optional): Whether to use all_gather operation. Defaults to True.
+            mixed_precision (str, optional): Autocast precision, one of bf16, fp16 or fp32. Defaults to bf16.
         """
         super().__init__(
             config_path=config_path,
@@ -49,6 +240,8 @@ class SiglipForPretrain(_SiglipForPretrain):
             gradient_checkpointing=gradient_checkpointing,
             use_all_gather=use_all_gather,
         )
+        self.use_device = _DEVICE_TYPE
+        self.use_dtype = _autocast_dtype(self.use_device, mixed_precision)
 
     @classmethod
     @add_default_section_for_init("core/model/pretrain/siglip")
@@ -65,66 +258,52 @@ class SiglipForPretrain(_SiglipForPretrain):
         """
         config.set_default_section("core/model/pretrain/siglip")
         pretrained_name = config.getoption("pretrained_name", "siglip-base-patch16-224")
-        config_path = config.getoption("config_path", None)
-        config_path = pop_value(
-            config_path,
-            nested_dict_value(pretrained_siglip_infos, pretrained_name, "config"),
-        )
-
-        config_path = cached_path(config_path)
+        paths = _resolve_siglip_paths(config, pretrained_name)
 
         freeze_base_model = config.getoption("freeze_base_model", True)
-        gradient_checkpointing = config.getoption("gradient_checkpointing", False)
+        gradient_checkpointing = config.getoption(
+            "gradient_checkpointing",
+            _default_gradient_checkpointing(pretrained_name),
+        )
         use_all_gather = config.getoption("use_all_gather", True)
+        mixed_precision = config.getoption("mixed_precision", "bf16")
 
         inst = cls(
-            config_path=config_path,
+            config_path=paths.config_path,
             freeze_base_model=freeze_base_model,
             gradient_checkpointing=gradient_checkpointing,
             use_all_gather=use_all_gather,
+            mixed_precision=mixed_precision,
         )
-        pretrained_weight_path = config.getoption("pretrained_weight_path", None)
-        weight_path = pop_value(
-            pretrained_weight_path,
-            nested_dict_value(pretrained_siglip_infos, pretrained_name, "weight"),
-            check_none=False,
-        )
-        if weight_path is not None:
-            inst.from_pretrained(weight_path)
+        if paths.weight_path is not None:
+            if config.getoption("cache_pretrained_weights", False):
+                state_dict = _load_cached_weight(paths.weight_path)
+                inst.from_pretrained(state_dict=state_dict)
+            else:
+                inst.from_pretrained(paths.weight_path)
 
-        return inst
+        quantization = config.getoption("quantization", None)
+        if quantization is not None:
+            _quantize_model(inst, quantization, freeze_base_model)
 
-    @autocast(device_type=("cuda" if torch.cuda.is_available() else "cpu"))
-    def forward(
-        self,
-        input_ids: torch.Tensor,
-        pixel_values: torch.Tensor,
-        attention_mask: Optional[torch.Tensor] = None,
-        position_ids: Optional[torch.Tensor] = None,
-    ):
-        """
-        Perform a forward pass through the model.
+        if gradient_checkpointing:
+            _enable_gradient_checkpointing(inst)
 
-        Args:
-            input_ids (torch.Tensor): Input token IDs.
-            pixel_values (torch.Tensor): Input pixel values.
-            attention_mask (torch.Tensor, optional): Attention mask. Defaults to None.
-            position_ids (torch.Tensor, optional): Position IDs. Defaults to None.
+        if torch.cuda.is_available():
+            inst.to(memory_format=torch.channels_last)
 
-        Returns:
-            LossOutputs: The loss outputs.
-        """
-        outputs = super().forward(
-            input_ids=input_ids,
-            pixel_values=pixel_values,
-            attention_mask=attention_mask,
-            position_ids=position_ids,
-        )
-        return LossOutputs(loss=outputs)
+        if config.getoption("compile_tail", False):
+            inst.pretrain_loss = _compile_tail(inst.pretrain_loss)
+
+        use_compile = config.getoption("use_compile", False)
+        if use_compile and torch.cuda.is_available():
+            _compile_model(inst)
+
+        return inst
 
 
 @register_model("core/model/classification/siglip")
-class SiglipForClassification(_SiglipForClassification):
+class SiglipForClassification(_SiglipForwardMixin, _SiglipForClassification):
     """CLIP model for classification."""
 
     def __init__(
@@ -133,6 +312,7 @@ class SiglipForClassification(_SiglipForClassification):
         num_classes: Optional[int] = 1,
         freeze_base_model: Optional[bool] = True,
         gradient_checkpointing: Optional[bool] = False,
+        mixed_precision: Optional[str] = "bf16",
     ):
         """
         Initialize the SiglipForClassification model.
@@ -143,6 +323,7 @@ class SiglipForClassification(_SiglipForClassification):
             num_classes (int, optional): The number of output classes. Defaults to 1.
             freeze_base_model (bool, optional): Whether to freeze the base model. Defaults to True.
             gradient_checkpointing (bool, optional): Whether to use gradient checkpointing. Defaults to False.
+            mixed_precision (str, optional): Autocast precision, one of bf16, fp16 or fp32. Defaults to bf16.
         """
         super().__init__(
             config_path=config_path,
@@ -150,6 +331,8 @@ class SiglipForClassification(_SiglipForClassification):
             freeze_base_model=freeze_base_model,
             gradient_checkpointing=gradient_checkpointing,
         )
+        self.use_device = _DEVICE_TYPE
+        self.use_dtype = _autocast_dtype(self.use_device, mixed_precision)
 
     @classmethod
     @add_default_section_for_init("core/model/classification/siglip")
@@ -166,66 +349,49 @@ class SiglipForClassification(_SiglipForClassification):
         """
         config.set_default_section("core/model/classification/siglip")
         pretrained_name = config.getoption("pretrained_name", "siglip-base-patch16-224")
-        config_path = config.getoption("config_path", None)
-        config_path = pop_value(
-            config_path,
-            nested_dict_value(pretrained_siglip_infos, pretrained_name, "config"),
-        )
-
-        config_path = cached_path(config_path)
+        paths = _resolve_siglip_paths(config, pretrained_name)
 
         num_classes = config.getoption("num_classes", 1)
         freeze_base_model = config.getoption("freeze_base_model", True)
-        gradient_checkpointing = config.getoption("gradient_checkpointing", False)
+        gradient_checkpointing = config.getoption(
+            "gradient_checkpointing",
+            _default_gradient_checkpointing(pretrained_name),
+        )
+        mixed_precision = config.getoption("mixed_precision", "bf16")
 
         inst = cls(
-            config_path=config_path,
+            config_path=paths.config_path,
             num_classes=num_classes,
             freeze_base_model=freeze_base_model,
             gradient_checkpointing=gradient_checkpointing,
+            mixed_precision=mixed_precision,
         )
-        pretrained_weight_path = config.getoption("pretrained_weight_path", None)
-        weight_path = pop_value(
-            pretrained_weight_path,
-            nested_dict_value(pretrained_siglip_infos, pretrained_name, "weight"),
-            check_none=False,
-        )
-        if weight_path is not None:
-            inst.from_pretrained(weight_path)
+        if paths.weight_path is not None:
+            if config.getoption("cache_pretrained_weights", False):
+                state_dict = _load_cached_weight(paths.weight_path)
+                inst.from_pretrained(state_dict=state_dict)
+            else:
+                inst.from_pretrained(paths.weight_path)
 
-        return inst
+        quantization = config.getoption("quantization", None)
+        if quantization is not None:
+            _quantize_model(inst, quantization, freeze_base_model)
 
-    @autocast(device_type=("cuda" if torch.cuda.is_available() else "cpu"))
-    def forward(
-        self,
-        input_ids: torch.Tensor,
-        pixel_values: torch.Tensor,
-        attention_mask: Optional[torch.Tensor] = None,
-        position_ids: Optional[torch.Tensor] = None,
-    ):
-        """
-        Perform a forward pass through the model.
+        if gradient_checkpointing:
+            _enable_gradient_checkpointing(inst)
 
-        Args:
-            input_ids (torch.Tensor): Input token IDs.
-            pixel_values (torch.Tensor): Input pixel values.
-            attention_mask (torch.Tensor, optional): Attention mask. Defaults to None.
-            position_ids (torch.Tensor, optional): Position IDs. Defaults to None.
+        if torch.cuda.is_available():
+            inst.to(memory_format=torch.channels_last)
 
-        Returns:
-            ClassificationOutputs: The classification outputs.
-        """
-        outputs = super().forward(
-            input_ids=input_ids,
-            pixel_values=pixel_values,
-            attention_mask=attention_mask,
-            position_ids=position_ids,
-        )
-        return ClassificationOutputs(outputs=outputs)
+        use_compile = config.getoption("use_compile", False)
+        if use_compile and torch.cuda.is_available():
+            _compile_model(inst)
+
+        return inst
 
 
 @register_model("core/model/classification/siglip/text")
-class SiglipForTextClassification(_SiglipForTextClassification):
+class SiglipForTextClassification(_SiglipForwardMixin, _SiglipForTextClassification):
     """CLIP model for text classification."""
 
     def __init__(
@@ -234,6 +400,7 @@ class SiglipForTextClassification(_SiglipForTextClassification):
         num_classes: Optional[int] = 1,
         freeze_base_model: Optional[bool] = True,
         gradient_checkpointing: Optional[bool] = False,
+        mixed_precision: Optional[str] = "bf16",
     ):
         """
         Initialize the SiglipForTextClassification model.
@@ -244,6 +411,7 @@ class SiglipForTextClassification(_SiglipForTextClassification):
             num_classes (int, optional): The number of output classes. Defaults to 1.
             freeze_base_model (bool, optional): Whether to freeze the base model. Defaults to True.
             gradient_checkpointing (bool, optional): Whether to use gradient checkpointing. Defaults to False.
+            mixed_precision (str, optional): Autocast precision, one of bf16, fp16 or fp32. Defaults to bf16.
         """
         super().__init__(
             config_path=config_path,
@@ -251,6 +419,8 @@ class SiglipForTextClassification(_SiglipForTextClassification):
             freeze_base_model=freeze_base_model,
             gradient_checkpointing=gradient_checkpointing,
         )
+        self.use_device = _DEVICE_TYPE
+        self.use_dtype = _autocast_dtype(self.use_device, mixed_precision)
 
     @classmethod
     @add_default_section_for_init("core/model/classification/siglip/text")
@@ -267,71 +437,65 @@ class SiglipForTextClassification(_SiglipForTextClassification):
         """
         config.set_default_section("core/model/classification/siglip/text")
         pretrained_name = config.getoption("pretrained_name", "siglip-base-patch16-224")
-        config_path = config.getoption("config_path", None)
-        config_path = pop_value(
-            config_path,
-            nested_dict_value(pretrained_siglip_infos, pretrained_name, "config"),
-        )
-
-        config_path = cached_path(config_path)
+        paths = _resolve_siglip_paths(config, pretrained_name)
 
         num_classes = config.getoption("num_classes", 1)
-        freeze_base_model = config.getoption("freeze_base_Truemodel", True)
-        gradient_checkpointing = config.getoption("gradient_checkpointing", False)
+        if config.getoption("freeze_base_Truemodel", None) is not None:
+            logging.warning(
+                "freeze_base_Truemodel is ignored for siglip text classification, "
+                "use freeze_base_model instead."
+            )
+        freeze_base_model = config.getoption("freeze_base_model", True)
+        gradient_checkpointing = config.getoption(
+            "gradient_checkpointing",
+            _default_gradient_checkpointing(pretrained_name),
+        )
+        mixed_precision = config.getoption("mixed_precision", "bf16")
 
         inst = cls(
-            config_path=config_path,
+            config_path=paths.config_path,
             num_classes=num_classes,
             freeze_base_model=freeze_base_model,
             gradient_checkpointing=gradient_checkpointing,
+            mixed_precision=mixed_precision,
         )
-        pretrained_weight_path = config.getoption("pretrained_weight_path", None)
-        weight_path = pop_value(
-            pretrained_weight_path,
-            nested_dict_value(pretrained_siglip_infos, pretrained_name, "weight"),
-            check_none=False,
-        )
-        if weight_path is not None:
-            inst.from_pretrained(weight_path)
+        if paths.weight_path is not None:
+            if config.getoption("cache_pretrained_weights", False):
+                state_dict = _load_cached_weight(paths.weight_path)
+                inst.from_pretrained(state_dict=state_dict)
+            else:
+                inst.from_pretrained(paths.weight_path)
 
-        return inst
+        quantization = config.getoption("quantization", None)
+        if quantization is not None:
+            _quantize_model(inst, quantization, freeze_base_model)
 
-    @autocast(device_type=("cuda" if torch.cuda.is_available() else "cpu"))
-    def forward(
-        self,
-        input_ids=None,
-        attention_mask: Optional[torch.Tensor] = None,
-        position_ids: Optional[torch.Tensor] = None,
-    ):
-        """
-        Perform a forward pass through the model.
+        if gradient_checkpointing:
+            _enable_gradient_checkpointing(inst)
 
-        Args:
-            input_ids (torch.Tensor, optional): Input token IDs. Defaults to None.
-            attention_mask (torch.Tensor, optional): Attention mask. Defaults to None.
-            position_ids (torch.Tensor, optional): Position IDs. Defaults to None.
+        if torch.cuda.is_available():
+            inst.to(memory_format=torch.channels_last)
 
-        Returns:
-            ClassificationOutputs: The classification outputs.
-        """
-        outputs = super().forward(
-            input_ids=input_ids,
-            attention_mask=attention_mask,
-            position_ids=position_ids,
-        )
-        return ClassificationOutputs(outputs=outputs)
+        use_compile = config.getoption("use_compile", False)
+        if use_compile and torch.cuda.is_available():
+            _compile_model(inst)
+
+        return inst
 
 
 @register_model("core/model/classification/siglip/image")
-class SiglipForImageClassification(_SiglipForImageClassification):
+class SiglipForImageClassification(_SiglipForwardMixin, _SiglipForImageClassification):
     """CLIP model for image classification."""
 
+    _optional_inputs = ()
+
     def __init__(
         self,
         config_path: str,
         num_classes: Optional[int] = 1,
         freeze_base_model: Optional[bool] = True,
         gradient_checkpointing: Optional[bool] = False,
+        mixed_precision: Optional[str] = "bf16",
     ):
         """
         Initialize the SiglipForImageClassification model.
@@ -342,6 +506,7 @@ class SiglipForImageClassification(_SiglipForImageClassification):
             num_classes (int, optional): The number of output classes. Defaults to 1.
             freeze_base_model (bool, optional): Whether to freeze the base model. Defaults to True.
             gradient_checkpointing (bool, optional): Whether to use gradient checkpointing. Defaults to False.
+            mixed_precision (str, optional): Autocast precision, one of bf16, fp16 or fp32. Defaults to bf16.
         """
         super().__init__(
             config_path=config_path,
@@ -349,6 +514,8 @@ class SiglipForImageClassification(_SiglipForImageClassification):
             freeze_base_model=freeze_base_model,
             gradient_checkpointing=gradient_checkpointing,
         )
+        self.use_device = _DEVICE_TYPE
+        self.use_dtype = _autocast_dtype(self.use_device, mixed_precision)
 
     @classmethod
     @add_default_section_for_init("core/model/classification/siglip/image")
@@ -365,55 +532,49 @@ class SiglipForImageClassification(_SiglipForImageClassification):
         """
         config.set_default_section("core/model/classification/siglip/image")
         pretrained_name = config.getoption("pretrained_name", "siglip-base-patch16-224")
-        config_path = config.getoption("config_path", None)
-        config_path = pop_value(
-            config_path,
-            nested_dict_value(pretrained_siglip_infos, pretrained_name, "config"),
-        )
-
-        config_path = cached_path(config_path)
+        paths = _resolve_siglip_paths(config, pretrained_name)
 
         num_classes = config.getoption("num_classes", 1)
         freeze_base_model = config.getoption("freeze_base_model", True)
-        gradient_checkpointing = config.getoption("gradient_checkpointing", False)
+        gradient_checkpointing = config.getoption(
+            "gradient_checkpointing",
+            _default_gradient_checkpointing(pretrained_name),
+        )
+        mixed_precision = config.getoption("mixed_precision", "bf16")
 
         inst = cls(
-            config_path=config_path,
+            config_path=paths.config_path,
             num_classes=num_classes,
             freeze_base_model=freeze_base_model,
             gradient_checkpointing=gradient_checkpointing,
+            mixed_precision=mixed_precision,
         )
-        pretrained_weight_path = config.getoption("pretrained_weight_path", None)
-        weight_path = pop_value(
-            pretrained_weight_path,
-            nested_dict_value(pretrained_siglip_infos, pretrained_name, "weight"),
-            check_none=False,
-        )
-        if weight_path is not None:
-            inst.from_pretrained(weight_path)
+        if paths.weight_path is not None:
+            if config.getoption("cache_pretrained_weights", False):
+                state_dict = _load_cached_weight(paths.weight_path)
+                inst.from_pretrained(state_dict=state_dict)
+            else:
+                inst.from_pretrained(paths.weight_path)
 
-        return inst
+        quantization = config.getoption("quantization", None)
+        if quantization is not None:
+            _quantize_model(inst, quantization, freeze_base_model)
 
-    @autocast(device_type=("cuda" if torch.cuda.is_available() else "cpu"))
-    def forward(
-        self,
-        pixel_values: torch.Tensor,
-    ):
-        """
-        Perform a forward pass through the model.
+        if gradient_checkpointing:
+            _enable_gradient_checkpointing(inst)
 
-        Args:
-            pixel_values (torch.Tensor): Input pixel values.
+        if torch.cuda.is_available():
+            inst.to(memory_format=torch.channels_last)
 
-        Returns:
-            ClassificationOutputs: The classification outputs.
-        """
-        outputs = super().forward(pixel_values=pixel_values)
-        return ClassificationOutputs(outputs=outputs)
+        use_compile = config.getoption("use_compile", False)
+        if use_compile and torch.cuda.is_available():
+            _compile_model(inst)
+
+        return inst
 
 
 @register_model("core/model/matching/siglip")
-class SiglipForMatching(_SiglipForMatching):
+class SiglipForMatching(_SiglipForwardMixin, _SiglipForMatching):
     """CLIP model for classification."""
 
     def __init__(
@@ -421,6 +582,7 @@ class SiglipForMatching(_SiglipForMatching):
         config_path: str,
         freeze_base_model: Optional[bool] = True,
         gradient_checkpointing: Optional[bool] = False,
+        mixed_precision: Optional[str] = "bf16",
     ):
         """
         Initialize the SiglipForClassification model.
@@ -431,12 +593,15 @@ class SiglipForMatching(_SiglipForMatching):
             num_classes (int, optional): The number of output classes. Defaults to 1.
             freeze_base_model (bool, optional): Whether to freeze the base model. Defaults to True.
             gradient_checkpointing (bool, optional): Whether to use gradient checkpointing. Defaults to False.
+            mixed_precision (str, optional): Autocast precision, one of bf16, fp16 or fp32. Defaults to bf16.
         """
         super().__init__(
             config_path=config_path,
             freeze_base_model=freeze_base_model,
             gradient_checkpointing=gradient_checkpointing,
         )
+        self.use_device = _DEVICE_TYPE
+        self.use_dtype = _autocast_dtype(self.use_device, mixed_precision)
 
     @classmethod
     @add_default_section_for_init("core/model/matching/siglip")
@@ -453,57 +618,43 @@ class SiglipForMatching(_SiglipForMatching):
         """
         config.set_default_section("core/model/matching/siglip")
         pretrained_name = config.getoption("pretrained_name", "siglip-base-patch16-224")
-        config_path = config.getoption("config_path", None)
-        config_path = pop_value(
-            config_path,
-            nested_dict_value(pretrained_siglip_infos, pretrained_name, "config"),
-        )
-
-        config_path = cached_path(config_path)
+        paths = _resolve_siglip_paths(config, pretrained_name)
 
         freeze_base_model = config.getoption("freeze_base_model", True)
-        gradient_checkpointing = config.getoption("gradient_checkpointing", False)
+        gradient_checkpointing = config.getoption(
+            "gradient_checkpointing",
+            _default_gradient_checkpointing(pretrained_name),
+        )
+        mixed_precision = config.getoption("mixed_precision", "bf16")
 
         inst = cls(
-            config_path=config_path,
+            config_path=paths.config_path,
             freeze_base_model=freeze_base_model,
             gradient_checkpointing=gradient_checkpointing,
+            mixed_precision=mixed_precision,
         )
-        pretrained_weight_path = config.getoption("pretrained_weight_path", None)
-        weight_path = pop_value(
-            pretrained_weight_path,
-            nested_dict_value(pretrained_siglip_infos, pretrained_name, "weight"),
-            check_none=False,
-        )
-        if weight_path is not None:
-            inst.from_pretrained(weight_path)
+        if paths.weight_path is not None:
+            if config.getoption("cache_pretrained_weights", False):
+                state_dict = _load_cached_weight(paths.weight_path)
+                inst.from_pretrained(state_dict=state_dict)
+            else:
+                inst.from_pretrained(paths.weight_path)
 
-        return inst
+        quantization = config.getoption("quantization", None)
+        if quantization is not None:
+            _quantize_model(inst, quantization, freeze_base_model)
 
-    @autocast(device_type=("cuda" if torch.cuda.is_available() else "cpu"))
-    def forward(
-        self,
-        input_ids: torch.Tensor,
-        pixel_values: torch.Tensor,
-        attention_mask: Optional[torch.Tensor] = None,
-        position_ids: Optional[torch.Tensor] = None,
-    ):
-        """
-        Perform a forward pass through the model.
+        if gradient_checkpointing:
+            _enable_gradient_checkpointing(inst)
 
-        Args:
-            input_ids (torch.Tensor): Input token IDs.
-            pixel_values (torch.Tensor): Input pixel values.
-            attention_mask (torch.Tensor, optional): Attention mask. Defaults to None.
-            position_ids (torch.Tensor, optional): Position IDs. Defaults to None.
+        if torch.cuda.is_available():
+            inst.to(memory_format=torch.channels_last)
 
-        Returns:
-            ClassificationOutputs: The classification outputs.
-        """
-        outputs = super().forward(
-            input_ids=input_ids,
-            pixel_values=pixel_values,
-            attention_mask=attention_mask,
-            position_ids=position_ids,
-        )
-        return ClassificationOutputs(outputs=outputs)
+        if config.getoption("compile_tail", False):
+            inst.matching_scores = _compile_tail(inst.matching_scores)
+
+        use_compile = config.getoption("use_compile", False)
+        if use_compile and torch.cuda.is_available():
+            _compile_model(inst)
+
+        return inst
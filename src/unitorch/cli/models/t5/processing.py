@@ -1,6 +1,11 @@
 # Copyright (c) FULIUCANSHENG.
 # Licensed under the MIT License.
 
+import os
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from itertools import chain
 from typing import Any, Callable, Dict, List, Optional, Set, Tuple, Union
 
 from unitorch.utils import pop_value, nested_dict_value
@@ -20,13 +25,37 @@ from unitorch.cli.models import (
 from unitorch.cli.models.t5 import pretrained_t5_infos
 
 
+@lru_cache(maxsize=256)
+def _cached_path(url_or_filename):
+    return cached_path(url_or_filename)
+
+
+@lru_cache(maxsize=64)
+def _t5_info(pretrained_name, key):
+    return nested_dict_value(pretrained_t5_infos, pretrained_name, key)
+
+
+# shared across processors and kept off the instance, so processors stay picklable
+@lru_cache(maxsize=1)
+def _detokenize_pool():
+    return ThreadPoolExecutor(max_workers=os.cpu_count())
+
+
+_GENERATION_INPUTS_FIELD_MAP = {
+    "input_ids": "input_ids",
+    "attention_mask": "attention_mask",
+    "decoder_input_ids": "input_ids_pair",
+    "decoder_attention_mask": "attention_mask_pair",
+}
+
+
 class T5Processor(_T5Processor):
     """T5 Processor for text generation."""
 
     def __init__(
         self,
         vocab_path: str,
-        special_input_ids: Optional[Dict] = dict(),
+        special_input_ids: Optional[Dict] = None,
         max_seq_length: Optional[int] = 128,
         max_gen_seq_length: Optional[int] = 48,
     ):
@@ -35,7 +64,7 @@ class T5Processor(_T5Processor):
 
         Args:
             vocab_path (str): The path to the vocabulary file.
-            special_input_ids (Optional[Dict]): A dictionary containing special input IDs. Defaults to an empty dictionary.
+            special_input_ids (Optional[Dict]): A dictionary of special tokens to input IDs. Defaults to None.
             max_seq_length (Optional[int]): The maximum sequence length. Defaults to 128.
             max_gen_seq_length (Optional[int]): The maximum generated sequence length. Defaults to 48.
         """
@@ -64,9 +93,9 @@ class T5Processor(_T5Processor):
         vocab_path = config.getoption("vocab_path", None)
         vocab_path = pop_value(
             vocab_path,
-            nested_dict_value(pretrained_t5_infos, pretrained_name, "vocab"),
+            _t5_info(pretrained_name, "vocab"),
         )
-        vocab_path = cached_path(vocab_path)
+        vocab_path = _cached_path(vocab_path)
 
         return {
             "vocab_path": vocab_path,
@@ -145,11 +174,9 @@ class T5Processor(_T5Processor):
             max_seq_length=max_seq_length,
             max_gen_seq_length=max_gen_seq_length,
         )
-        return TensorsInputs(
-            input_ids=outputs.input_ids,
-            attention_mask=outputs.attention_mask,
-            decoder_input_ids=outputs.input_ids_pair,
-            decoder_attention_mask=outputs.attention_mask_pair,
+        return TensorsInputs.from_outputs(
+            outputs,
+            field_map=_GENERATION_INPUTS_FIELD_MAP,
         ), GenerationTargets(
             refs=outputs.input_ids_label,
             masks=outputs.attention_mask_label,
@@ -169,9 +196,23 @@ class T5Processor(_T5Processor):
         Returns:
             WriterOutputs: The detokenized writer outputs.
         """
-        results = outputs.to_pandas()
-        assert results.shape[0] == 0 or results.shape[0] == outputs.sequences.shape[0]
+        sequences = outputs.sequences
+        num_chunks = min(os.cpu_count() or 1, sequences.size(0))
+        if num_chunks > 1:
+            # sentencepiece decoding releases the gil, so row chunks decode in parallel
+            detokenize = super().detokenize
+            chunks = _detokenize_pool().map(
+                lambda chunk: detokenize(sequences=chunk),
+                sequences.chunk(num_chunks),
+            )
+            decoded = list(chain.from_iterable(chunks))
+        else:
+            decoded = super().detokenize(sequences=sequences)
+        # only go through to_pandas when the outputs carry extra columns
+        if not hasattr(outputs, "__pandas_dataframe__"):
+            return WriterOutputs(pd.DataFrame({"decoded": decoded}))
 
-        decoded = super().detokenize(sequences=outputs.sequences)
+        results = outputs.to_pandas()
+        assert results.shape[0] == 0 or results.shape[0] == sequences.shape[0]
         results["decoded"] = decoded
         return WriterOutputs(results)
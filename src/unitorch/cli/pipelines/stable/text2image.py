@@ -83,6 +83,11 @@ class StableForText2ImageGenerationPipeline(GenericStableModel):
         self._enable_cpu_offload = enable_cpu_offload
         self._enable_xformers = enable_xformers
 
+        # built once and reused across calls, the controlnet one is kept for
+        # the last requested checkpoints so repeated requests skip the reload
+        self._text2image_pipeline = None
+        self._controlnet_pipeline = (None, None)
+
     @classmethod
     @add_default_section_for_init("core/pipeline/stable/text2image")
     def from_core_configure(
@@ -226,47 +231,59 @@ class StableForText2ImageGenerationPipeline(GenericStableModel):
         if any(ckpt is not None for ckpt in controlnet_checkpoints) and any(
             img is not None for img in controlnet_images
         ):
-            controlnets, conditioning_scales, conditioning_images = [], [], []
-            for checkpoint, conditioning_scale, conditioning_image in zip(
-                controlnet_checkpoints, controlnet_guidance_scales, controlnet_images
-            ):
-                if checkpoint is None or conditioning_image is None:
-                    continue
-                controlnet_config_path = cached_path(
-                    nested_dict_value(
-                        pretrained_stable_extensions_infos,
-                        checkpoint,
-                        "controlnet",
-                        "config",
-                    )
+            selected = [
+                (checkpoint, conditioning_scale, conditioning_image)
+                for checkpoint, conditioning_scale, conditioning_image in zip(
+                    controlnet_checkpoints,
+                    controlnet_guidance_scales,
+                    controlnet_images,
                 )
-                controlnet_config_dict = json.load(open(controlnet_config_path))
-                controlnet = ControlNetModel.from_config(controlnet_config_dict)
-                controlnet.load_state_dict(
-                    load_weight(
+                if checkpoint is not None and conditioning_image is not None
+            ]
+            checkpoints = tuple(checkpoint for checkpoint, _, _ in selected)
+            conditioning_scales = [scale for _, scale, _ in selected]
+            conditioning_images = [
+                image.resize((width, height)) for _, _, image in selected
+            ]
+            cached_checkpoints, pipeline = self._controlnet_pipeline
+            if cached_checkpoints != checkpoints:
+                controlnets = []
+                for checkpoint in checkpoints:
+                    controlnet_config_path = cached_path(
                         nested_dict_value(
                             pretrained_stable_extensions_infos,
                             checkpoint,
                             "controlnet",
-                            "weight",
+                            "config",
                         )
                     )
+                    controlnet_config_dict = json.load(open(controlnet_config_path))
+                    controlnet = ControlNetModel.from_config(controlnet_config_dict)
+                    controlnet.load_state_dict(
+                        load_weight(
+                            nested_dict_value(
+                                pretrained_stable_extensions_infos,
+                                checkpoint,
+                                "controlnet",
+                                "weight",
+                            )
+                        )
+                    )
+                    controlnet.to(device=self._device)
+                    logging.info(f"Loading controlnet from {checkpoint}")
+                    controlnets.append(controlnet)
+                pipeline = StableDiffusionControlNetPipeline(
+                    vae=self.vae,
+                    text_encoder=self.text,
+                    unet=self.unet,
+                    controlnet=controlnets,
+                    scheduler=self.scheduler,
+                    tokenizer=None,
+                    safety_checker=None,
+                    feature_extractor=None,
                 )
-                controlnet.to(device=self._device)
-                logging.info(f"Loading controlnet from {checkpoint}")
-                controlnets.append(controlnet)
-                conditioning_scales.append(conditioning_scale)
-                conditioning_images.append(conditioning_image.resize((width, height)))
-            self.pipeline = StableDiffusionControlNetPipeline(
-                vae=self.vae,
-                text_encoder=self.text,
-                unet=self.unet,
-                controlnet=controlnets,
-                scheduler=self.scheduler,
-                tokenizer=None,
-                safety_checker=None,
-                feature_extractor=None,
-            )
+                self._controlnet_pipeline = (checkpoints, pipeline)
+            self.pipeline = pipeline
             controlnets_inputs = self.processor.controlnets_inputs(conditioning_images)
             enable_controlnet = True
             inputs = {
@@ -274,17 +291,21 @@ class StableForText2ImageGenerationPipeline(GenericStableModel):
                 **{"condition_pixel_values": controlnets_inputs.pixel_values},
             }
         else:
-            self.pipeline = StableDiffusionPipeline(
-                vae=self.vae,
-                text_encoder=self.text,
-                unet=self.unet,
-                scheduler=self.scheduler,
-                tokenizer=None,
-                safety_checker=None,
-                feature_extractor=None,
-            )
+            if self._text2image_pipeline is None:
+                self._text2image_pipeline = StableDiffusionPipeline(
+                    vae=self.vae,
+                    text_encoder=self.text,
+                    unet=self.unet,
+                    scheduler=self.scheduler,
+                    tokenizer=None,
+                    safety_checker=None,
+                    feature_extractor=None,
+                )
+            self.pipeline = self._text2image_pipeline
             enable_controlnet = False
             inputs = text_inputs
+        # the scheduler may have been swapped above
+        self.pipeline.scheduler = self.scheduler
         self.pipeline.set_progress_bar_config(disable=True)
         self.seed = seed
 
@@ -1,20 +1,35 @@
 # Copyright (c) FULIUCANSHENG.
 # Licensed under the MIT License.
 
+import threading
 import numpy as np
 from PIL import Image, ImageFilter
 from typing import Any, Dict, List, Optional, Tuple, Union
 from unitorch.utils import is_opencv_available
 
+_scratch = threading.local()
+
+
+def _gray_buffer(height: int, width: int):
+    # per-thread scratch for the grayscale image, reused across same sized inputs
+    buffer = getattr(_scratch, "gray", None)
+    if buffer is None or buffer.shape != (height, width):
+        buffer = np.empty((height, width), dtype=np.uint8)
+        _scratch.gray = buffer
+    return buffer
+
 
 def canny(image: Image.Image):
     if is_opencv_available():
         import cv2
 
-        image = np.array(image, np.uint8)
-        image = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
-        image = cv2.Canny(image, 100, 200)
-        image = Image.fromarray(image)
+        if image.mode != "RGB":
+            image = image.convert("RGB")
+        image = np.asarray(image)
+        gray = _gray_buffer(*image.shape[:2])
+        cv2.cvtColor(image, cv2.COLOR_RGB2GRAY, dst=gray)
+        # the edge map backs the returned image, so it can't be a shared buffer
+        image = Image.fromarray(cv2.Canny(gray, 100, 200))
     else:
         image = image.convert("L")
         image = image.filter(ImageFilter.FIND_EDGES)
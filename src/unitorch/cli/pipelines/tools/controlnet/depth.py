@@ -1,20 +1,29 @@
 # Copyright (c) FULIUCANSHENG.
 # Licensed under the MIT License.
 
+import os
+import threading
 import numpy as np
 from PIL import Image, ImageFilter
 from typing import Any, Dict, List, Optional, Tuple, Union
 from unitorch.cli import CoreConfigureParser
 from unitorch.cli.pipelines.dpt import DPTForDepthEstimationPipeline
 
+UNITORCH_DPT_DEVICE = os.environ.get("UNITORCH_DPT_DEVICE", "cpu")
+
 dpt_pipe = None
+_dpt_lock = threading.Lock()
 
 
 def depth(image: Image.Image):
     global dpt_pipe
+    # double-checked so concurrent requests build the heavy pipeline only once
     if dpt_pipe is None:
-        dpt_pipe = DPTForDepthEstimationPipeline.from_core_configure(
-            CoreConfigureParser(), pretrained_name="dpt-large"
-        )
-        dpt_pipe.to("cpu")
+        with _dpt_lock:
+            if dpt_pipe is None:
+                dpt_pipe = DPTForDepthEstimationPipeline.from_core_configure(
+                    CoreConfigureParser(),
+                    pretrained_name="dpt-large",
+                    device=UNITORCH_DPT_DEVICE,
+                )
     return dpt_pipe(image)
@@ -2,7 +2,6 @@
 # Licensed under the MIT License.
 
 import os
-import re
 import json
 import torch
 import logging
@@ -15,6 +14,7 @@ from unitorch import hf_cached_path
 from unitorch.utils import (
     replace,
     load_weight,
+    _compile_key_patterns,
     is_diffusers_available,
 )
 
@@ -116,7 +116,7 @@ class CheckpointMixin:
             state_dicts += state_dict if isinstance(state_dict, list) else [state_dict]
 
         self_state_dict = self.state_dict()  # Get the current state_dict of the model
-        load_keys = []  # Keep track of the keys loaded from the state_dict(s)
+        load_keys = dict()  # Keep track of the keys loaded from the state_dict(s)
         non_load_keys = []  # Keep track of the keys not loaded from the state_dict(s)
 
         if isinstance(self.replace_keys_in_state_dict, dict):
@@ -125,22 +125,25 @@ class CheckpointMixin:
         if isinstance(self.prefix_keys_in_state_dict, dict):
             prefix_keys = {**self.prefix_keys_in_state_dict, **prefix_keys}
 
+        # Patterns are compiled once and shared across calls with the same keys
+        prefix_patterns = _compile_key_patterns(tuple(prefix_keys.items()))
+        replace_patterns = _compile_key_patterns(tuple(replace_keys.items()))
+
         # Iterate over the state_dict(s) and load the matching keys into the model's state_dict
         for _state_dict in state_dicts:
             if not _state_dict:
                 continue
             for key, value in list(_state_dict.items()):
-                for rkey, prefix in prefix_keys.items():
-                    if re.match(rkey, key):
+                for pattern, prefix in prefix_patterns:
+                    if pattern.match(key):
                         key = prefix + key
                         break
 
-                for rkey, nkey in replace_keys.items():
-                    key = re.sub(rkey, nkey, key)
+                for pattern, nkey in replace_patterns:
+                    key = pattern.sub(nkey, key)
                 if key in self_state_dict and value.shape == self_state_dict[key].shape:
                     self_state_dict[key] = value
-                    if key not in load_keys:
-                        load_keys.append(key)
+                    load_keys[key] = None
                 else:
                     non_load_keys.append(key)
 
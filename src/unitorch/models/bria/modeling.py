@@ -808,7 +808,7 @@ class PyramidVisionTransformerImpr(nn.Module):
             self.block4[i].drop_path.drop_prob = dpr[cur + i]
 
     def freeze_patch_emb(self):
-        self.patch_embed1.requires_grad = False
+        self.patch_embed1.requires_grad_(False)
 
     @torch.jit.ignore
     def no_weight_decay(self):
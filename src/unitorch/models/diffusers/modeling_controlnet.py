@@ -14,6 +14,7 @@ from diffusers.models import (
     UNet2DConditionModel,
     AutoencoderKL,
 )
+from diffusers.models.attention_processor import AttnProcessor2_0
 from diffusers.pipelines import (
     StableDiffusionControlNetPipeline,
     StableDiffusionControlNetImg2ImgPipeline,
@@ -25,9 +26,73 @@ from unitorch.models import (
     QuantizationConfig,
     QuantizationMixin,
 )
+from unitorch.utils import is_xformers_available
 from unitorch.models.diffusers import GenericStableModel
 
 
+def _enable_efficient_attention(model: GenericModel):
+    # older diffusers releases can leave vanilla attention on some blocks
+    if hasattr(F, "scaled_dot_product_attention"):
+        modules = [model.unet, model.vae]
+        controlnet = model.controlnet
+        if controlnet is not None:
+            modules += controlnet.nets if hasattr(controlnet, "nets") else [controlnet]
+        for module in modules:
+            module.set_attn_processor(AttnProcessor2_0())
+    elif is_xformers_available():
+        model.pipeline.enable_xformers_memory_efficient_attention()
+
+
+def _prefetch_to_device(tensors: List[torch.Tensor], device: torch.device):
+    # copy cpu inputs on a side stream so the transfer overlaps prompt encoding
+    if device.type != "cuda" or not any(
+        t is not None and t.device.type == "cpu" for t in tensors
+    ):
+        return tensors, None
+    stream = torch.cuda.Stream(device)
+    with torch.cuda.stream(stream):
+        tensors = [
+            (
+                t.pin_memory().to(device, non_blocking=True)
+                if t is not None and t.device.type == "cpu"
+                else t
+            )
+            for t in tensors
+        ]
+    return tensors, stream
+
+
+def _wait_prefetch(stream: Optional[torch.cuda.Stream], tensors: List[torch.Tensor]):
+    if stream is None:
+        return
+    current = torch.cuda.current_stream(stream.device)
+    current.wait_stream(stream)
+    # the copies were allocated on the side stream, keep them alive for this one
+    for t in tensors:
+        if t is not None:
+            t.record_stream(current)
+
+
+def _get_prompt_outputs(
+    model: GenericStableModel,
+    offload_text_encoder: Optional[bool] = False,
+    **kwargs,
+):
+    if offload_text_encoder:
+        # a previous call may have parked the encoder on the cpu, moved outside
+        # inference mode so its weights stay usable for training and loading
+        with torch.inference_mode(False):
+            model.text.to(model.unet.device)
+    outputs = model.get_prompt_outputs(**kwargs)
+    if offload_text_encoder:
+        # the denoising loop only needs the embeds, free the encoder memory for it
+        with torch.inference_mode(False):
+            model.text.to("cpu")
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+    return outputs
+
+
 class ControlNetForText2ImageGeneration(GenericStableModel):
     def __init__(
         self,
@@ -77,6 +142,23 @@ class ControlNetForText2ImageGeneration(GenericStableModel):
             feature_extractor=None,
         )
         self.pipeline.set_progress_bar_config(disable=True)
+        _enable_efficient_attention(self)
+
+    def _prepare_noisy_latents(
+        self,
+        pixel_values: torch.Tensor,
+        timesteps: torch.Tensor,
+    ):
+        # kept apart from forward so the elementwise tail can be compiled as one unit
+        latents = self.vae.encode(pixel_values).latent_dist.sample()
+        latents = latents * self.vae.config.scaling_factor
+        noise = torch.randn(latents.shape, device=latents.device)
+        noise_latents = self.scheduler.add_noise(
+            latents,
+            noise,
+            timesteps,
+        )
+        return latents, noise, noise_latents
 
     def forward(
         self,
@@ -85,10 +167,7 @@ class ControlNetForText2ImageGeneration(GenericStableModel):
         condition_pixel_values: torch.Tensor,
         attention_mask: Optional[torch.Tensor] = None,
     ):
-        latents = self.vae.encode(pixel_values).latent_dist.sample()
-        latents = latents * self.vae.config.scaling_factor
-        noise = torch.randn(latents.shape).to(latents.device)
-        batch = latents.size(0)
+        batch = pixel_values.size(0)
 
         timesteps = torch.randint(
             0,
@@ -97,9 +176,8 @@ class ControlNetForText2ImageGeneration(GenericStableModel):
             device=pixel_values.device,
         ).long()
 
-        noise_latents = self.scheduler.add_noise(
-            latents,
-            noise,
+        latents, noise, noise_latents = self._prepare_noisy_latents(
+            pixel_values,
             timesteps,
         )
 
@@ -124,7 +202,7 @@ class ControlNetForText2ImageGeneration(GenericStableModel):
         loss = F.mse_loss(outputs, noise, reduction="mean")
         return loss
 
-    @torch.no_grad()
+    @torch.inference_mode()
     def generate(
         self,
         condition_pixel_values: torch.Tensor,
@@ -136,8 +214,21 @@ class ControlNetForText2ImageGeneration(GenericStableModel):
         width: Optional[int] = 512,
         guidance_scale: Optional[float] = 7.5,
         controlnet_conditioning_scale: Optional[Union[float, List[float]]] = None,
+        offload_text_encoder: Optional[bool] = False,
+        num_images_per_prompt: Optional[int] = 1,
     ):
-        outputs = self.get_prompt_outputs(
+        # inputs are batched by row, one prompt pair and condition per row
+        assert (
+            input_ids.size(0)
+            == negative_input_ids.size(0)
+            == condition_pixel_values.size(0)
+        )
+        (condition_pixel_values,), stream = _prefetch_to_device(
+            [condition_pixel_values], self.unet.device
+        )
+        outputs = _get_prompt_outputs(
+            self,
+            offload_text_encoder=offload_text_encoder,
             input_ids=input_ids,
             negative_input_ids=negative_input_ids,
             attention_mask=attention_mask,
@@ -157,6 +248,7 @@ class ControlNetForText2ImageGeneration(GenericStableModel):
                 controlnet_conditioning_scale
             ] * self.num_controlnets
 
+        _wait_prefetch(stream, [condition_pixel_values])
         images = self.pipeline(
             image=condition_pixel_values
             if self.num_controlnets == 1
@@ -171,10 +263,12 @@ class ControlNetForText2ImageGeneration(GenericStableModel):
             width=width,
             guidance_scale=guidance_scale,
             controlnet_conditioning_scale=controlnet_conditioning_scale,
-            output_type="np.array",
-        ).images
+            num_images_per_prompt=num_images_per_prompt,
+            output_type="pt",
+            return_dict=False,
+        )[0]
 
-        return GenericOutputs(images=torch.from_numpy(images))
+        return GenericOutputs(images=images.float().permute(0, 2, 3, 1))
 
 
 class ControlNetForImage2ImageGeneration(GenericStableModel):
@@ -226,13 +320,14 @@ class ControlNetForImage2ImageGeneration(GenericStableModel):
             feature_extractor=None,
         )
         self.pipeline.set_progress_bar_config(disable=True)
+        _enable_efficient_attention(self)
 
     def forward(
         self,
     ):
         raise NotImplementedError
 
-    @torch.no_grad()
+    @torch.inference_mode()
     def generate(
         self,
         pixel_values: torch.Tensor,
@@ -244,8 +339,17 @@ class ControlNetForImage2ImageGeneration(GenericStableModel):
         strength: Optional[float] = 1.0,
         guidance_scale: Optional[float] = 7.5,
         controlnet_conditioning_scale: Optional[float] = 1.0,
+        offload_text_encoder: Optional[bool] = False,
+        num_images_per_prompt: Optional[int] = 1,
     ):
-        outputs = self.get_prompt_outputs(
+        # inputs are batched by row, one prompt pair and image per row
+        assert input_ids.size(0) == negative_input_ids.size(0) == pixel_values.size(0)
+        (pixel_values, condition_pixel_values), stream = _prefetch_to_device(
+            [pixel_values, condition_pixel_values], self.unet.device
+        )
+        outputs = _get_prompt_outputs(
+            self,
+            offload_text_encoder=offload_text_encoder,
             input_ids=input_ids,
             negative_input_ids=negative_input_ids,
             attention_mask=attention_mask,
@@ -265,6 +369,7 @@ class ControlNetForImage2ImageGeneration(GenericStableModel):
                 controlnet_conditioning_scale
             ] * self.num_controlnets
 
+        _wait_prefetch(stream, [pixel_values, condition_pixel_values])
         images = self.pipeline(
             image=pixel_values,
             control_image=condition_pixel_values
@@ -279,10 +384,12 @@ class ControlNetForImage2ImageGeneration(GenericStableModel):
             strength=strength,
             guidance_scale=guidance_scale,
             controlnet_conditioning_scale=controlnet_conditioning_scale,
-            output_type="np.array",
-        ).images
+            num_images_per_prompt=num_images_per_prompt,
+            output_type="pt",
+            return_dict=False,
+        )[0]
 
-        return GenericOutputs(images=torch.from_numpy(images))
+        return GenericOutputs(images=images.float().permute(0, 2, 3, 1))
 
 
 class ControlNetForImageInpainting(GenericStableModel):
@@ -336,13 +443,14 @@ class ControlNetForImageInpainting(GenericStableModel):
             feature_extractor=None,
         )
         self.pipeline.set_progress_bar_config(disable=True)
+        _enable_efficient_attention(self)
 
     def forward(
         self,
     ):
         raise NotImplementedError
 
-    @torch.no_grad()
+    @torch.inference_mode()
     def generate(
         self,
         pixel_values: torch.Tensor,
@@ -357,7 +465,11 @@ class ControlNetForImageInpainting(GenericStableModel):
         guidance_scale: Optional[float] = 7.5,
         controlnet_conditioning_scale: Optional[Union[float, List[float]]] = None,
         inpainting_controlnet_conditioning_scale: Optional[float] = None,
+        offload_text_encoder: Optional[bool] = False,
+        num_images_per_prompt: Optional[int] = 1,
     ):
+        # inputs are batched by row, one prompt pair and image per row
+        assert input_ids.size(0) == negative_input_ids.size(0) == pixel_values.size(0)
         assert (
             condition_pixel_values is not None
             or inpainting_condition_pixel_values is not None
@@ -392,13 +504,20 @@ class ControlNetForImageInpainting(GenericStableModel):
                 controlnet_conditioning_scale = [
                     controlnet_conditioning_scale
                 ] * self.num_controlnets
-        outputs = self.get_prompt_outputs(
+        tensors, stream = _prefetch_to_device(
+            [pixel_values, pixel_masks, condition_pixel_values], self.unet.device
+        )
+        pixel_values, pixel_masks, condition_pixel_values = tensors
+        outputs = _get_prompt_outputs(
+            self,
+            offload_text_encoder=offload_text_encoder,
             input_ids=input_ids,
             negative_input_ids=negative_input_ids,
             attention_mask=attention_mask,
             negative_attention_mask=negative_attention_mask,
         )
 
+        _wait_prefetch(stream, [pixel_values, pixel_masks, condition_pixel_values])
         images = self.pipeline(
             image=pixel_values,
             mask_image=pixel_masks,
@@ -416,7 +535,9 @@ class ControlNetForImageInpainting(GenericStableModel):
             strength=strength,
             guidance_scale=guidance_scale,
             controlnet_conditioning_scale=controlnet_conditioning_scale,
-            output_type="np.array",
-        ).images
+            num_images_per_prompt=num_images_per_prompt,
+            output_type="pt",
+            return_dict=False,
+        )[0]
 
-        return GenericOutputs(images=torch.from_numpy(images))
+        return GenericOutputs(images=images.float().permute(0, 2, 3, 1))
@@ -141,7 +141,7 @@ class ControlNetFluxForText2ImageGeneration(GenericStableFluxModel):
             self.dtype,
         )
 
-        noise = torch.randn(latents.shape).to(latents.device)
+        noise = torch.randn(latents.shape, device=latents.device)
         batch = latents.shape[0]
 
         u = compute_density_for_timestep_sampling(
@@ -26,6 +26,7 @@ from unitorch.models import (
     QuantizationMixin,
 )
 from unitorch.models.diffusers import GenericStableXLModel
+from unitorch.models.diffusers.modeling_controlnet import _enable_efficient_attention
 
 
 class ControlNetXLForText2ImageGeneration(GenericStableXLModel):
@@ -101,6 +102,7 @@ class ControlNetXLForText2ImageGeneration(GenericStableXLModel):
             tokenizer_2=None,
         )
         self.pipeline.set_progress_bar_config(disable=True)
+        _enable_efficient_attention(self)
 
     def forward(
         self,
@@ -145,7 +147,7 @@ class ControlNetXLForText2ImageGeneration(GenericStableXLModel):
         latents = self.vae.encode(pixel_values).latent_dist.sample()
         latents = latents * self.vae.config.scaling_factor
 
-        noise = torch.randn(latents.shape).to(latents.device)
+        noise = torch.randn(latents.shape, device=latents.device)
         batch = latents.size(0)
 
         timesteps = torch.randint(
@@ -190,6 +192,7 @@ class ControlNetXLForText2ImageGeneration(GenericStableXLModel):
         loss = F.mse_loss(outputs, noise, reduction="mean")
         return loss
 
+    @torch.inference_mode()
     def generate(
         self,
         condition_pixel_values: torch.Tensor,
@@ -235,6 +238,7 @@ class ControlNetXLForText2ImageGeneration(GenericStableXLModel):
             attention2_mask=attention2_mask,
             negative_attention_mask=negative_attention_mask,
             negative_attention2_mask=negative_attention2_mask,
+            do_classifier_free_guidance=guidance_scale > 1.0,
         )
         if controlnet_conditioning_scale is None:
             if self.num_controlnets == 1:
@@ -265,10 +269,10 @@ class ControlNetXLForText2ImageGeneration(GenericStableXLModel):
             width=width,
             guidance_scale=guidance_scale,
             controlnet_conditioning_scale=controlnet_conditioning_scale,
-            output_type="np.array",
+            output_type="pt",
         ).images
 
-        return GenericOutputs(images=torch.from_numpy(images))
+        return GenericOutputs(images=images.float().permute(0, 2, 3, 1))
 
 
 class ControlNetXLForImage2ImageGeneration(GenericStableXLModel):
@@ -322,12 +326,14 @@ class ControlNetXLForImage2ImageGeneration(GenericStableXLModel):
             tokenizer_2=None,
         )
         self.pipeline.set_progress_bar_config(disable=True)
+        _enable_efficient_attention(self)
 
     def forward(
         self,
     ):
         raise NotImplementedError
 
+    @torch.inference_mode()
     def generate(
         self,
         input_ids: torch.Tensor,
@@ -353,6 +359,7 @@ class ControlNetXLForImage2ImageGeneration(GenericStableXLModel):
             attention2_mask=attention2_mask,
             negative_attention_mask=negative_attention_mask,
             negative_attention2_mask=negative_attention2_mask,
+            do_classifier_free_guidance=guidance_scale > 1.0,
         )
         if controlnet_conditioning_scale is None:
             if self.num_controlnets == 1:
@@ -382,10 +389,10 @@ class ControlNetXLForImage2ImageGeneration(GenericStableXLModel):
             strength=strength,
             guidance_scale=guidance_scale,
             controlnet_conditioning_scale=controlnet_conditioning_scale,
-            output_type="np.array",
+            output_type="pt",
         ).images
 
-        return GenericOutputs(images=torch.from_numpy(images))
+        return GenericOutputs(images=images.float().permute(0, 2, 3, 1))
 
 
 class ControlNetXLForImageInpainting(GenericStableXLModel):
@@ -441,12 +448,14 @@ class ControlNetXLForImageInpainting(GenericStableXLModel):
             tokenizer_2=None,
         )
         self.pipeline.set_progress_bar_config(disable=True)
+        _enable_efficient_attention(self)
 
     def forward(
         self,
     ):
         raise NotImplementedError
 
+    @torch.inference_mode()
     def generate(
         self,
         input_ids: torch.Tensor,
@@ -510,6 +519,7 @@ class ControlNetXLForImageInpainting(GenericStableXLModel):
             attention2_mask=attention2_mask,
             negative_attention_mask=negative_attention_mask,
             negative_attention2_mask=negative_attention2_mask,
+            do_classifier_free_guidance=guidance_scale > 1.0,
         )
 
         images = self.pipeline(
@@ -531,7 +541,7 @@ class ControlNetXLForImageInpainting(GenericStableXLModel):
             strength=strength,
             guidance_scale=guidance_scale,
             controlnet_conditioning_scale=controlnet_conditioning_scale,
-            output_type="np.array",
+            output_type="pt",
         ).images
 
-        return GenericOutputs(images=torch.from_numpy(images))
+        return GenericOutputs(images=images.float().permute(0, 2, 3, 1))
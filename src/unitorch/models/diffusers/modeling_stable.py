@@ -4,6 +4,7 @@
 import json
 import torch
 import torch.nn.functional as F
+from functools import lru_cache
 from PIL import Image
 from typing import Any, Callable, Dict, List, Optional, Set, Tuple, Union
 import diffusers.schedulers as schedulers
@@ -77,6 +78,27 @@ def compute_snr(timesteps, noise_scheduler):
     return snr
 
 
+@lru_cache(maxsize=32)
+def _read_json_config(path: str) -> str:
+    with open(path, "r") as f:
+        return f.read()
+
+
+def _load_json_config(path: str) -> Dict[str, Any]:
+    # each instance gets its own dict, callers update the configs in place
+    return json.loads(_read_json_config(path))
+
+
+@lru_cache(maxsize=None)
+def _get_scheduler_class(name: str):
+    # diffusers.schedulers is a lazy module, resolve the class on first use
+    scheduler_class = getattr(schedulers, name, None)
+    assert scheduler_class is not None and issubclass(
+        scheduler_class, SchedulerMixin
+    ), f"{name} is not a diffusers scheduler."
+    return scheduler_class
+
+
 class GenericStableModel(GenericModel, QuantizationMixin, PeftWeightLoaderMixin):
     prefix_keys_in_state_dict = {
         # unet weights
@@ -132,7 +154,7 @@ class GenericStableModel(GenericModel, QuantizationMixin, PeftWeightLoaderMixin)
         self.image_size = image_size
         self.snr_gamma = snr_gamma
 
-        config_dict = json.load(open(config_path))
+        config_dict = _load_json_config(config_path)
         if image_size is not None:
             config_dict.update({"sample_size": image_size})
         if in_channels is not None:
@@ -141,10 +163,10 @@ class GenericStableModel(GenericModel, QuantizationMixin, PeftWeightLoaderMixin)
             config_dict.update({"out_channels": out_channels})
         self.unet = UNet2DConditionModel.from_config(config_dict)
 
-        text_config = CLIPTextConfig.from_json_file(text_config_path)
+        text_config = CLIPTextConfig.from_dict(_load_json_config(text_config_path))
         self.text = CLIPTextModel(text_config)
 
-        vae_config_dict = json.load(open(vae_config_path))
+        vae_config_dict = _load_json_config(vae_config_path)
         self.vae = AutoencoderKL.from_config(vae_config_dict)
 
         if isinstance(controlnet_configs_path, str):
@@ -161,14 +183,14 @@ class GenericStableModel(GenericModel, QuantizationMixin, PeftWeightLoaderMixin)
         if isinstance(controlnet_configs_path, list):
             controlnets = []
             for controlnet_config_path in controlnet_configs_path:
-                controlnet_config_dict = json.load(open(controlnet_config_path))
+                controlnet_config_dict = _load_json_config(controlnet_config_path)
                 controlnets.append(ControlNetModel.from_config(controlnet_config_dict))
             self.num_controlnets = len(controlnets)
             self.controlnet = MultiControlNetModel(
                 controlnets=controlnets,
             )
         elif isinstance(controlnet_configs_path, str):
-            controlnet_config_dict = json.load(open(controlnet_configs_path))
+            controlnet_config_dict = _load_json_config(controlnet_configs_path)
             self.controlnet = ControlNetModel.from_config(controlnet_config_dict)
             self.num_controlnets = 1
         else:
@@ -184,25 +206,23 @@ class GenericStableModel(GenericModel, QuantizationMixin, PeftWeightLoaderMixin)
         if isinstance(adapter_configs_path, list):
             adapters = []
             for adapter_config_path in adapter_configs_path:
-                adapter_config_dict = json.load(open(adapter_config_path))
+                adapter_config_dict = _load_json_config(adapter_config_path)
                 adapters.append(T2IAdapter.from_config(adapter_config_dict))
             self.num_adapters = len(adapters)
             self.adapter = MultiAdapter(
                 adapters=adapters,
             )
         elif isinstance(adapter_configs_path, str):
-            adapter_config_dict = json.load(open(adapter_configs_path))
+            adapter_config_dict = _load_json_config(adapter_configs_path)
             self.adapter = T2IAdapter.from_config(adapter_config_dict)
             self.num_adapters = 1
         else:
             self.adapter = None
             self.num_adapters = 0
 
-        scheduler_config_dict = json.load(open(scheduler_config_path))
+        scheduler_config_dict = _load_json_config(scheduler_config_path)
         scheduler_class_name = scheduler_config_dict.get("_class_name", "DDPMScheduler")
-        assert hasattr(schedulers, scheduler_class_name)
-        scheduler_class = getattr(schedulers, scheduler_class_name)
-        assert issubclass(scheduler_class, SchedulerMixin)
+        scheduler_class = _get_scheduler_class(scheduler_class_name)
         scheduler_config_dict["num_train_timesteps"] = num_train_timesteps
         self.scheduler = scheduler_class.from_config(scheduler_config_dict)
 
@@ -237,14 +257,15 @@ class GenericStableModel(GenericModel, QuantizationMixin, PeftWeightLoaderMixin)
             self.text.to(cpu_offload_device)
             input_ids = input_ids.to(cpu_offload_device)
             negative_input_ids = negative_input_ids.to(cpu_offload_device)
-        prompt_embeds = self.text(
-            input_ids,
-            # attention_mask,
-        )[0]
-        negative_prompt_embeds = self.text(
-            negative_input_ids,
-            # negative_attention_mask,
-        )[0]
+        # one batched pass for both prompts when their lengths match,
+        # attention masks are not passed, the clip encoder attends to the padding
+        if input_ids.shape[1:] == negative_input_ids.shape[1:]:
+            prompt_embeds, negative_prompt_embeds = self.text(
+                torch.cat([input_ids, negative_input_ids], dim=0),
+            )[0].split([input_ids.size(0), negative_input_ids.size(0)], dim=0)
+        else:
+            prompt_embeds = self.text(input_ids)[0]
+            negative_prompt_embeds = self.text(negative_input_ids)[0]
         if enable_cpu_offload:
             self.text.to("cpu")
         return GenericOutputs(
@@ -982,7 +1003,7 @@ class StableForImage2VideoGeneration(GenericModel):
         self.num_train_timesteps = num_train_timesteps
         self.num_infer_timesteps = num_infer_timesteps
 
-        config_dict = json.load(open(config_path))
+        config_dict = _load_json_config(config_path)
         if image_size is not None:
             config_dict.update({"sample_size": image_size})
         if in_channels is not None:
@@ -997,14 +1018,12 @@ class StableForImage2VideoGeneration(GenericModel):
             image_process_config_path
         )
 
-        vae_config_dict = json.load(open(vae_config_path))
+        vae_config_dict = _load_json_config(vae_config_path)
         self.vae = AutoencoderKLTemporalDecoder.from_config(vae_config_dict)
 
-        scheduler_config_dict = json.load(open(scheduler_config_path))
+        scheduler_config_dict = _load_json_config(scheduler_config_path)
         scheduler_class_name = scheduler_config_dict.get("_class_name", "DDPMScheduler")
-        assert hasattr(schedulers, scheduler_class_name)
-        scheduler_class = getattr(schedulers, scheduler_class_name)
-        assert issubclass(scheduler_class, SchedulerMixin)
+        scheduler_class = _get_scheduler_class(scheduler_class_name)
         scheduler_config_dict["num_train_timesteps"] = num_train_timesteps
         self.scheduler = scheduler_class.from_config(scheduler_config_dict)
 
@@ -1,15 +1,13 @@
 # Copyright (c) FULIUCANSHENG.
 # Licensed under the MIT License.
 
-import json
 import torch
 import torch.nn.functional as F
 from typing import Any, Callable, Dict, List, Optional, Set, Tuple, Union
-import diffusers.schedulers as schedulers
 from transformers import CLIPTextConfig, CLIPTextModel, CLIPTextModelWithProjection
 from transformers.models.t5.configuration_t5 import T5Config
 from transformers.models.t5.modeling_t5 import T5EncoderModel
-from diffusers.schedulers import SchedulerMixin, FlowMatchEulerDiscreteScheduler
+from diffusers.schedulers import FlowMatchEulerDiscreteScheduler
 from diffusers.training_utils import (
     compute_loss_weighting_for_sd3,
     compute_density_for_timestep_sampling,
@@ -33,6 +31,11 @@ from unitorch.models import (
 )
 from unitorch.models.peft import PeftWeightLoaderMixin
 from unitorch.models.diffusers import compute_snr
+from unitorch.models.diffusers.modeling_stable import (
+    _get_scheduler_class,
+    _load_json_config,
+)
+from unitorch.models.diffusers.modeling_stable_xl import _encode_prompt_pair
 
 
 class GenericStable3Model(GenericModel, QuantizationMixin, PeftWeightLoaderMixin):
@@ -79,7 +82,7 @@ class GenericStable3Model(GenericModel, QuantizationMixin, PeftWeightLoaderMixin
         self.num_infer_timesteps = num_infer_timesteps
         self.snr_gamma = snr_gamma
 
-        config_dict = json.load(open(config_path))
+        config_dict = _load_json_config(config_path)
         if image_size is not None:
             config_dict.update({"sample_size": image_size})
         if in_channels is not None:
@@ -97,7 +100,7 @@ class GenericStable3Model(GenericModel, QuantizationMixin, PeftWeightLoaderMixin
         text_config3 = T5Config.from_json_file(text3_config_path)
         self.text3 = T5EncoderModel(text_config3)
 
-        vae_config_dict = json.load(open(vae_config_path))
+        vae_config_dict = _load_json_config(vae_config_path)
         self.vae = AutoencoderKL.from_config(vae_config_dict)
 
         if isinstance(controlnet_configs_path, str):
@@ -114,7 +117,7 @@ class GenericStable3Model(GenericModel, QuantizationMixin, PeftWeightLoaderMixin
         if isinstance(controlnet_configs_path, list):
             controlnets = []
             for controlnet_config_path in controlnet_configs_path:
-                controlnet_config_dict = json.load(open(controlnet_config_path))
+                controlnet_config_dict = _load_json_config(controlnet_config_path)
                 controlnets.append(
                     SD3ControlNetModel.from_config(controlnet_config_dict)
                 )
@@ -123,20 +126,18 @@ class GenericStable3Model(GenericModel, QuantizationMixin, PeftWeightLoaderMixin
                 controlnets=controlnets,
             )
         elif isinstance(controlnet_configs_path, str):
-            controlnet_config_dict = json.load(open(controlnet_configs_path))
+            controlnet_config_dict = _load_json_config(controlnet_configs_path)
             self.controlnet = SD3ControlNetModel.from_config(controlnet_config_dict)
             self.num_controlnets = 1
         else:
             self.controlnet = None
             self.num_controlnets = 0
 
-        scheduler_config_dict = json.load(open(scheduler_config_path))
+        scheduler_config_dict = _load_json_config(scheduler_config_path)
         scheduler_class_name = scheduler_config_dict.get(
             "_class_name", "FlowMatchEulerDiscreteScheduler"
         )
-        assert hasattr(schedulers, scheduler_class_name)
-        scheduler_class = getattr(schedulers, scheduler_class_name)
-        assert issubclass(scheduler_class, SchedulerMixin)
+        scheduler_class = _get_scheduler_class(scheduler_class_name)
         scheduler_config_dict["num_train_timesteps"] = num_train_timesteps
         self.scheduler = scheduler_class.from_config(scheduler_config_dict)
 
@@ -201,47 +202,27 @@ class GenericStable3Model(GenericModel, QuantizationMixin, PeftWeightLoaderMixin
             negative_input2_ids = negative_input2_ids.to(cpu_offload_device)
             negative_input3_ids = negative_input3_ids.to(cpu_offload_device)
 
-        prompt_outputs = self.text(
-            input_ids,
-            # attention_mask,
-            output_hidden_states=True,
+        prompt_outputs, negative_prompt_outputs = _encode_prompt_pair(
+            self.text, input_ids, negative_input_ids
         )
         pooled_prompt_embeds = prompt_outputs[0]
         prompt_embeds = prompt_outputs.hidden_states[-2]
-        negative_prompt_outputs = self.text(
-            negative_input_ids,
-            # negative_attention_mask,
-            output_hidden_states=True,
-        )
         negative_pooled_prompt_embeds = negative_prompt_outputs[0]
         negative_prompt_embeds = negative_prompt_outputs.hidden_states[-2]
 
-        prompt2_outputs = self.text2(
-            input2_ids,
-            # attention2_mask,
-            output_hidden_states=True,
+        prompt2_outputs, negative_prompt2_outputs = _encode_prompt_pair(
+            self.text2, input2_ids, negative_input2_ids
         )
         pooled_prompt2_embeds = prompt2_outputs[0]
         prompt2_embeds = prompt2_outputs.hidden_states[-2]
-        negative_prompt2_outputs = self.text2(
-            negative_input2_ids,
-            # negative_attention2_mask,
-            output_hidden_states=True,
-        )
         negative_pooled_prompt2_embeds = negative_prompt2_outputs[0]
         negative_prompt2_embeds = negative_prompt2_outputs.hidden_states[-2]
 
-        prompt3_outputs = self.text3(
-            input3_ids,
-            # attention3_mask,
-            output_hidden_states=True,
+        # the first t5 output is its last hidden state
+        prompt3_outputs, negative_prompt3_outputs = _encode_prompt_pair(
+            self.text3, input3_ids, negative_input3_ids
         )
         prompt3_embeds = prompt3_outputs[0]
-        negative_prompt3_outputs = self.text3(
-            negative_input3_ids,
-            # negative_attention3_mask,
-            output_hidden_states=True,
-        )
         negative_prompt3_embeds = negative_prompt3_outputs[0]
 
         prompt_embeds = torch.concat([prompt_embeds, prompt2_embeds], dim=-1)
@@ -1,11 +1,9 @@
 # Copyright (c) FULIUCANSHENG.
 # Licensed under the MIT License.
 
-import json
 import torch
 import torch.nn.functional as F
 from typing import Any, Callable, Dict, List, Optional, Set, Tuple, Union
-import diffusers.schedulers as schedulers
 from transformers import (
     PretrainedConfig,
     CLIPTextConfig,
@@ -16,7 +14,7 @@ from transformers import (
 )
 from transformers.models.t5.configuration_t5 import T5Config
 from transformers.models.t5.modeling_t5 import T5EncoderModel
-from diffusers.schedulers import SchedulerMixin, FlowMatchEulerDiscreteScheduler
+from diffusers.schedulers import FlowMatchEulerDiscreteScheduler
 from diffusers.training_utils import (
     compute_loss_weighting_for_sd3,
     compute_density_for_timestep_sampling,
@@ -43,6 +41,10 @@ from unitorch.models import (
 )
 from unitorch.models.peft import PeftWeightLoaderMixin
 from unitorch.models.diffusers import compute_snr
+from unitorch.models.diffusers.modeling_stable import (
+    _get_scheduler_class,
+    _load_json_config,
+)
 
 
 def _prepare_latent_image_ids(batch_size, height, width, device, dtype):
@@ -132,7 +134,7 @@ class GenericStableFluxModel(GenericModel, QuantizationMixin, PeftWeightLoaderMi
         self.num_infer_timesteps = num_infer_timesteps
         self.snr_gamma = snr_gamma
 
-        config_dict = json.load(open(config_path))
+        config_dict = _load_json_config(config_path)
         if image_size is not None:
             config_dict.update({"sample_size": image_size})
         if in_channels is not None:
@@ -149,7 +151,7 @@ class GenericStableFluxModel(GenericModel, QuantizationMixin, PeftWeightLoaderMi
         text_config2 = T5Config.from_json_file(text2_config_path)
         self.text2 = T5EncoderModel(text_config2).to(torch.bfloat16)
 
-        vae_config_dict = json.load(open(vae_config_path))
+        vae_config_dict = _load_json_config(vae_config_path)
         self.vae = AutoencoderKL.from_config(vae_config_dict).to(torch.bfloat16)
 
         if isinstance(controlnet_configs_path, str):
@@ -166,7 +168,7 @@ class GenericStableFluxModel(GenericModel, QuantizationMixin, PeftWeightLoaderMi
         if isinstance(controlnet_configs_path, list):
             controlnets = []
             for controlnet_config_path in controlnet_configs_path:
-                controlnet_config_dict = json.load(open(controlnet_config_path))
+                controlnet_config_dict = _load_json_config(controlnet_config_path)
                 controlnets.append(
                     FluxControlNetModel.from_config(controlnet_config_dict).to(
                         torch.bfloat16
@@ -177,7 +179,7 @@ class GenericStableFluxModel(GenericModel, QuantizationMixin, PeftWeightLoaderMi
                 controlnets=controlnets,
             )
         elif isinstance(controlnet_configs_path, str):
-            controlnet_config_dict = json.load(open(controlnet_configs_path))
+            controlnet_config_dict = _load_json_config(controlnet_configs_path)
             self.controlnet = FluxControlNetModel.from_config(
                 controlnet_config_dict
             ).to(torch.bfloat16)
@@ -186,13 +188,11 @@ class GenericStableFluxModel(GenericModel, QuantizationMixin, PeftWeightLoaderMi
             self.controlnet = None
             self.num_controlnets = 0
 
-        scheduler_config_dict = json.load(open(scheduler_config_path))
+        scheduler_config_dict = _load_json_config(scheduler_config_path)
         scheduler_class_name = scheduler_config_dict.get(
             "_class_name", "FlowMatchEulerDiscreteScheduler"
         )
-        assert hasattr(schedulers, scheduler_class_name)
-        scheduler_class = getattr(schedulers, scheduler_class_name)
-        assert issubclass(scheduler_class, SchedulerMixin)
+        scheduler_class = _get_scheduler_class(scheduler_class_name)
         scheduler_config_dict["num_train_timesteps"] = num_train_timesteps
         self.scheduler = scheduler_class.from_config(scheduler_config_dict)
 
@@ -1,13 +1,10 @@
 # Copyright (c) FULIUCANSHENG.
 # Licensed under the MIT License.
 
-import json
 import torch
 import torch.nn.functional as F
 from typing import Any, Callable, Dict, List, Optional, Set, Tuple, Union
-import diffusers.schedulers as schedulers
 from transformers import CLIPTextConfig, CLIPTextModel, CLIPTextModelWithProjection
-from diffusers.schedulers import SchedulerMixin
 from diffusers.models import (
     ControlNetModel,
     UNet2DModel,
@@ -31,6 +28,38 @@ from unitorch.models import (
 )
 from unitorch.models.peft import PeftWeightLoaderMixin
 from unitorch.models.diffusers import compute_snr
+from unitorch.models.diffusers.modeling_stable import (
+    _get_scheduler_class,
+    _load_json_config,
+)
+
+
+def _encode_prompt_pair(
+    text_encoder: torch.nn.Module,
+    input_ids: torch.Tensor,
+    negative_input_ids: torch.Tensor,
+):
+    # one batched pass for the positive and negative prompts when lengths match
+    if input_ids.shape[1:] != negative_input_ids.shape[1:]:
+        return (
+            text_encoder(input_ids, output_hidden_states=True),
+            text_encoder(negative_input_ids, output_hidden_states=True),
+        )
+    batch = input_ids.size(0)
+    outputs = text_encoder(
+        torch.cat([input_ids, negative_input_ids], dim=0),
+        output_hidden_states=True,
+    )
+    return (
+        GenericOutputs(
+            pooler_output=outputs[0][:batch],
+            hidden_states=tuple(h[:batch] for h in outputs.hidden_states),
+        ),
+        GenericOutputs(
+            pooler_output=outputs[0][batch:],
+            hidden_states=tuple(h[batch:] for h in outputs.hidden_states),
+        ),
+    )
 
 
 class GenericStableXLModel(GenericModel, QuantizationMixin, PeftWeightLoaderMixin):
@@ -86,7 +115,7 @@ class GenericStableXLModel(GenericModel, QuantizationMixin, PeftWeightLoaderMixi
         self.num_infer_timesteps = num_infer_timesteps
         self.snr_gamma = snr_gamma
 
-        config_dict = json.load(open(config_path))
+        config_dict = _load_json_config(config_path)
         if image_size is not None:
             config_dict.update({"sample_size": image_size})
         if in_channels is not None:
@@ -95,13 +124,13 @@ class GenericStableXLModel(GenericModel, QuantizationMixin, PeftWeightLoaderMixi
             config_dict.update({"out_channels": out_channels})
         self.unet = UNet2DConditionModel.from_config(config_dict)
 
-        text_config = CLIPTextConfig.from_json_file(text_config_path)
+        text_config = CLIPTextConfig.from_dict(_load_json_config(text_config_path))
         self.text = CLIPTextModel(text_config)
 
-        text_config2 = CLIPTextConfig.from_json_file(text2_config_path)
+        text_config2 = CLIPTextConfig.from_dict(_load_json_config(text2_config_path))
         self.text2 = CLIPTextModelWithProjection(text_config2)
 
-        vae_config_dict = json.load(open(vae_config_path))
+        vae_config_dict = _load_json_config(vae_config_path)
         self.vae = AutoencoderKL.from_config(vae_config_dict)
 
         if isinstance(controlnet_configs_path, str):
@@ -118,14 +147,14 @@ class GenericStableXLModel(GenericModel, QuantizationMixin, PeftWeightLoaderMixi
         if isinstance(controlnet_configs_path, list):
             controlnets = []
             for controlnet_config_path in controlnet_configs_path:
-                controlnet_config_dict = json.load(open(controlnet_config_path))
+                controlnet_config_dict = _load_json_config(controlnet_config_path)
                 controlnets.append(ControlNetModel.from_config(controlnet_config_dict))
             self.num_controlnets = len(controlnets)
             self.controlnet = MultiControlNetModel(
                 controlnets=controlnets,
             )
         elif isinstance(controlnet_configs_path, str):
-            controlnet_config_dict = json.load(open(controlnet_configs_path))
+            controlnet_config_dict = _load_json_config(controlnet_configs_path)
             self.controlnet = ControlNetModel.from_config(controlnet_config_dict)
             self.num_controlnets = 1
         else:
@@ -141,25 +170,23 @@ class GenericStableXLModel(GenericModel, QuantizationMixin, PeftWeightLoaderMixi
         if isinstance(adapter_configs_path, list):
             adapters = []
             for adapter_config_path in adapter_configs_path:
-                adapter_config_dict = json.load(open(adapter_config_path))
+                adapter_config_dict = _load_json_config(adapter_config_path)
                 adapters.append(T2IAdapter.from_config(adapter_config_dict))
             self.num_adapters = len(adapters)
             self.adapter = MultiAdapter(
                 adapters=adapters,
             )
         elif isinstance(adapter_configs_path, str):
-            adapter_config_dict = json.load(open(adapter_configs_path))
+            adapter_config_dict = _load_json_config(adapter_configs_path)
             self.adapter = T2IAdapter.from_config(adapter_config_dict)
             self.num_adapters = 1
         else:
             self.adapter = None
             self.num_adapters = 0
 
-        scheduler_config_dict = json.load(open(scheduler_config_path))
+        scheduler_config_dict = _load_json_config(scheduler_config_path)
         scheduler_class_name = scheduler_config_dict.get("_class_name", "DDPMScheduler")
-        assert hasattr(schedulers, scheduler_class_name)
-        scheduler_class = getattr(schedulers, scheduler_class_name)
-        assert issubclass(scheduler_class, SchedulerMixin)
+        scheduler_class = _get_scheduler_class(scheduler_class_name)
         scheduler_config_dict["num_train_timesteps"] = num_train_timesteps
         self.scheduler = scheduler_class.from_config(scheduler_config_dict)
 
@@ -193,7 +220,16 @@ class GenericStableXLModel(GenericModel, QuantizationMixin, PeftWeightLoaderMixi
         negative_attention2_mask: Optional[torch.Tensor] = None,
         enable_cpu_offload: Optional[bool] = False,
         cpu_offload_device: Optional[str] = "cpu",
+        do_classifier_free_guidance: Optional[bool] = True,
     ):
+        if not do_classifier_free_guidance:
+            # without guidance the pipeline never reads the negative embeddings
+            return self._get_positive_prompt_outputs(
+                input_ids=input_ids,
+                input2_ids=input2_ids,
+                enable_cpu_offload=enable_cpu_offload,
+                cpu_offload_device=cpu_offload_device,
+            )
         if enable_cpu_offload:
             self.text.to(cpu_offload_device)
             self.text2.to(cpu_offload_device)
@@ -201,29 +237,16 @@ class GenericStableXLModel(GenericModel, QuantizationMixin, PeftWeightLoaderMixi
             input2_ids = input2_ids.to(cpu_offload_device)
             negative_input_ids = negative_input_ids.to(cpu_offload_device)
             negative_input2_ids = negative_input2_ids.to(cpu_offload_device)
-        outputs = self.text(
-            input_ids,
-            # attention_mask,
-            output_hidden_states=True,
+        # attention masks are not passed, the clip encoders attend to the padding
+        outputs, negative_outputs = _encode_prompt_pair(
+            self.text, input_ids, negative_input_ids
         )
         prompt_embeds = outputs.hidden_states[-2]
-        negative_outputs = self.text(
-            negative_input_ids,
-            # negative_attention_mask,
-            output_hidden_states=True,
-        )
         negative_prompt_embeds = negative_outputs.hidden_states[-2]
-        prompt2_outputs = self.text2(
-            input2_ids,
-            # attention2_mask,
-            output_hidden_states=True,
+        prompt2_outputs, negative_prompt2_outputs = _encode_prompt_pair(
+            self.text2, input2_ids, negative_input2_ids
         )
         prompt2_embeds = prompt2_outputs.hidden_states[-2]
-        negative_prompt2_outputs = self.text2(
-            negative_input2_ids,
-            # negative_attention2_mask,
-            output_hidden_states=True,
-        )
         negative_prompt2_embeds = negative_prompt2_outputs.hidden_states[-2]
 
         prompt_embeds = torch.concat([prompt_embeds, prompt2_embeds], dim=-1)
@@ -250,6 +273,36 @@ class GenericStableXLModel(GenericModel, QuantizationMixin, PeftWeightLoaderMixi
             else negative_pooled_prompt_embeds,
         )
 
+    def _get_positive_prompt_outputs(
+        self,
+        input_ids: torch.Tensor,
+        input2_ids: torch.Tensor,
+        enable_cpu_offload: Optional[bool] = False,
+        cpu_offload_device: Optional[str] = "cpu",
+    ):
+        if enable_cpu_offload:
+            self.text.to(cpu_offload_device)
+            self.text2.to(cpu_offload_device)
+            input_ids = input_ids.to(cpu_offload_device)
+            input2_ids = input2_ids.to(cpu_offload_device)
+        outputs = self.text(input_ids, output_hidden_states=True)
+        prompt2_outputs = self.text2(input2_ids, output_hidden_states=True)
+        prompt_embeds = torch.concat(
+            [outputs.hidden_states[-2], prompt2_outputs.hidden_states[-2]], dim=-1
+        )
+        pooled_prompt_embeds = prompt2_outputs[0]
+        if enable_cpu_offload:
+            self.text.to("cpu")
+            self.text2.to("cpu")
+            prompt_embeds = prompt_embeds.to("cpu")
+            pooled_prompt_embeds = pooled_prompt_embeds.to("cpu")
+        return GenericOutputs(
+            prompt_embeds=prompt_embeds,
+            negative_prompt_embeds=None,
+            pooled_prompt_embeds=pooled_prompt_embeds,
+            negative_pooled_prompt_embeds=None,
+        )
+
 
 class StableXLForText2ImageGeneration(GenericStableXLModel):
     def __init__(
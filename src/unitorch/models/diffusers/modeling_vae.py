@@ -1,7 +1,6 @@
 # Copyright (c) FULIUCANSHENG.
 # Licensed under the MIT License.
 
-import json
 import torch
 import torchvision
 import torch.nn as nn
@@ -15,6 +14,7 @@ from unitorch.models import (
     QuantizationConfig,
     QuantizationMixin,
 )
+from unitorch.models.diffusers.modeling_stable import _load_json_config
 
 
 class VAEForDiffusion(GenericModel):
@@ -39,7 +39,7 @@ class VAEForDiffusion(GenericModel):
         stride: Optional[int] = 16,
     ):
         super().__init__()
-        config_dict = json.load(open(config_path))
+        config_dict = _load_json_config(config_path)
         self.vae = AutoencoderKL.from_config(config_dict)
         self.patch_size = patch_size
         self.stride = stride
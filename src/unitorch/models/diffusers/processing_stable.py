@@ -3,7 +3,6 @@
 
 import os
 import torch
-import json
 import numpy as np
 from PIL import Image
 from typing import Any, Callable, Dict, List, Optional, Set, Tuple, Union
@@ -24,6 +23,7 @@ from unitorch.models import (
     HfImageClassificationProcessor,
     GenericOutputs,
 )
+from unitorch.models.diffusers.modeling_stable import _load_json_config
 
 
 class StableProcessor(HfTextClassificationProcessor):
@@ -97,7 +97,7 @@ class StableProcessor(HfTextClassificationProcessor):
             )
 
         if vae_config_path is not None:
-            vae_config_dict = json.load(open(vae_config_path))
+            vae_config_dict = _load_json_config(vae_config_path)
             vae_scale_factor = 2 ** (
                 len(vae_config_dict.get("block_out_channels", [])) - 1
             )
@@ -194,7 +194,7 @@ class StableProcessor(HfTextClassificationProcessor):
 
         pixel_values = self.vae_image_processor.preprocess(image)[0]
         pixel_masks = self.vae_image_processor.preprocess(mask_image)[0]
-        pixel_masks = (pixel_masks + 1) / 2
+        pixel_masks = pixel_masks.add_(1).mul_(0.5)
 
         return GenericOutputs(
             pixel_values=pixel_values,
@@ -330,7 +330,7 @@ class StableVideoProcessor(HfImageClassificationProcessor):
         super().__init__(
             vision_processor=vision_processor,
         )
-        vae_config_dict = json.load(open(vae_config_path))
+        vae_config_dict = _load_json_config(vae_config_path)
         vae_scale_factor = 2 ** (len(vae_config_dict.get("block_out_channels", [])) - 1)
         self.vae_image_processor = VaeImageProcessor(vae_scale_factor=vae_scale_factor)
 
@@ -3,7 +3,6 @@
 
 import os
 import torch
-import json
 import numpy as np
 from PIL import Image
 from typing import Any, Callable, Dict, List, Optional, Set, Tuple, Union
@@ -21,6 +20,7 @@ from torchvision.transforms import (
 from torchvision.transforms.functional import crop
 from diffusers.image_processor import VaeImageProcessor
 from unitorch.models import HfTextClassificationProcessor, GenericOutputs
+from unitorch.models.diffusers.modeling_stable import _load_json_config
 
 
 class StableFluxProcessor:
@@ -113,7 +113,7 @@ class StableFluxProcessor:
             )
 
         if vae_config_path is not None:
-            vae_config_dict = json.load(open(vae_config_path))
+            vae_config_dict = _load_json_config(vae_config_path)
             vae_scale_factor = 2 ** (
                 len(vae_config_dict.get("block_out_channels", [])) - 1
             )
@@ -253,7 +253,7 @@ class StableFluxProcessor:
 
         pixel_values = self.vae_image_processor.preprocess(image)[0]
         pixel_masks = self.vae_image_processor.preprocess(mask_image)[0]
-        pixel_masks = (pixel_masks + 1) / 2
+        pixel_masks = pixel_masks.add_(1).mul_(0.5)
 
         return GenericOutputs(
             pixel_values=pixel_values,
@@ -3,7 +3,6 @@
 
 import os
 import torch
-import json
 import numpy as np
 from PIL import Image
 from typing import Any, Callable, Dict, List, Optional, Set, Tuple, Union
@@ -21,6 +20,7 @@ from torchvision.transforms import (
 from torchvision.transforms.functional import crop
 from diffusers.image_processor import VaeImageProcessor
 from unitorch.models import HfTextClassificationProcessor, GenericOutputs
+from unitorch.models.diffusers.modeling_stable import _load_json_config
 
 
 class StableXLProcessor:
@@ -68,6 +68,8 @@ class StableXLProcessor:
             max_seq_length=max_seq_length,
             position_start_id=position_start_id,
         )
+        # a plain dict, so the processor still pickles into dataloader workers
+        self._negative_prompt_outputs = dict()
 
         if image_size is not None:
             self.image_size = (
@@ -87,7 +89,8 @@ class StableXLProcessor:
                     else RandomCrop((self.image_size[1], self.image_size[0])),
                     RandomHorizontalFlip() if random_flip else Lambda(lambda x: x),
                     ToTensor(),
-                    Normalize([0.5], [0.5]),
+                    # ToTensor hands over a fresh tensor, normalize it in place
+                    Normalize([0.5], [0.5], inplace=True),
                 ]
             )
 
@@ -103,7 +106,7 @@ class StableXLProcessor:
                 [
                     RandomHorizontalFlip() if random_flip else Lambda(lambda x: x),
                     ToTensor(),
-                    Normalize([0.5], [0.5]),
+                    Normalize([0.5], [0.5], inplace=True),
                 ]
             )
 
@@ -114,7 +117,7 @@ class StableXLProcessor:
             )
 
         if vae_config_path is not None:
-            vae_config_dict = json.load(open(vae_config_path))
+            vae_config_dict = _load_json_config(vae_config_path)
             vae_scale_factor = 2 ** (
                 len(vae_config_dict.get("block_out_channels", [])) - 1
             )
@@ -161,6 +164,31 @@ class StableXLProcessor:
             add_time_ids=torch.tensor(add_time_ids),
         )
 
+    def _negative_classification(
+        self,
+        index: int,
+        text: str,
+        max_seq_length: Optional[int] = None,
+    ):
+        # negative prompts repeat across samples, tokenize each one only once
+        key = (index, text, max_seq_length)
+        if key not in self._negative_prompt_outputs:
+            if len(self._negative_prompt_outputs) >= 256:
+                self._negative_prompt_outputs.clear()
+            text_processor = (
+                self.text_processor1 if index == 1 else self.text_processor2
+            )
+            outputs = text_processor.classification(text, max_seq_length=max_seq_length)
+            self._negative_prompt_outputs[key] = (
+                outputs.input_ids,
+                outputs.attention_mask,
+            )
+        input_ids, attention_mask = self._negative_prompt_outputs[key]
+        return GenericOutputs(
+            input_ids=input_ids.clone(),
+            attention_mask=attention_mask.clone(),
+        )
+
     def text2image_inputs(
         self,
         prompt: str,
@@ -177,11 +205,11 @@ class StableXLProcessor:
         prompt2_outputs = self.text_processor2.classification(
             prompt2, max_seq_length=max_seq_length
         )
-        negative_prompt_outputs = self.text_processor1.classification(
-            negative_prompt, max_seq_length=max_seq_length
+        negative_prompt_outputs = self._negative_classification(
+            1, negative_prompt, max_seq_length
         )
-        negative_prompt2_outputs = self.text_processor2.classification(
-            negative_prompt2, max_seq_length=max_seq_length
+        negative_prompt2_outputs = self._negative_classification(
+            2, negative_prompt2, max_seq_length
         )
         return GenericOutputs(
             input_ids=prompt_outputs.input_ids,
@@ -237,7 +265,7 @@ class StableXLProcessor:
 
         pixel_values = self.vae_image_processor.preprocess(image)[0]
         pixel_masks = self.vae_image_processor.preprocess(mask_image)[0]
-        pixel_masks = (pixel_masks + 1) / 2
+        pixel_masks = pixel_masks.add_(1).mul_(0.5)
 
         return GenericOutputs(
             pixel_values=pixel_values,
@@ -228,7 +228,7 @@ class ControlNetLoraForText2ImageGeneration(GenericControlNetLoraModel):
     ):
         latents = self.vae.encode(pixel_values).latent_dist.sample()
         latents = latents * self.vae.config.scaling_factor
-        noise = torch.randn(latents.shape).to(latents.device)
+        noise = torch.randn(latents.shape, device=latents.device)
         batch = latents.size(0)
 
         timesteps = torch.randint(
@@ -299,7 +299,7 @@ class ControlNetLoraForText2ImageGeneration(GenericControlNetLoraModel):
             width=width,
             guidance_scale=guidance_scale,
             controlnet_conditioning_scale=float(controlnet_conditioning_scale),
-            output_type="np.array",
+            output_type="pt",
         ).images
 
-        return GenericOutputs(images=torch.from_numpy(images))
+        return GenericOutputs(images=images.float().permute(0, 2, 3, 1))
@@ -400,7 +400,7 @@ class ControlNet3LoraForText2ImageGeneration(GenericControlNet3LoraModel):
         latents = self.vae.encode(pixel_values).latent_dist.sample()
         latents = latents * self.vae.config.scaling_factor
 
-        noise = torch.randn(latents.shape).to(latents.device)
+        noise = torch.randn(latents.shape, device=latents.device)
         batch = latents.size(0)
 
         u = compute_density_for_timestep_sampling(
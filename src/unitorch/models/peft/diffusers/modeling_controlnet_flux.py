@@ -325,7 +325,7 @@ class ControlNetFluxLoraForText2ImageGeneration(GenericControlNetFluxLoraModel):
             self.dtype,
         )
 
-        noise = torch.randn(latents.shape).to(latents.device)
+        noise = torch.randn(latents.shape, device=latents.device)
         batch = latents.shape[0]
 
         u = compute_density_for_timestep_sampling(
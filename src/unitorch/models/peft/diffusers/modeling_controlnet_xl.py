@@ -29,6 +29,42 @@ from unitorch.models import (
 from unitorch.models.peft import GenericPeftModel
 
 
+class _ControlNetResidualCache:
+    """
+    Stands in for the controlnet call during generate, running it every `interval` steps.
+
+    It is installed as `_compiled_call_impl`, so the skip decision stays in python and the
+    (compiled) controlnet is traced once with its own forward.
+    """
+
+    def __init__(
+        self,
+        controlnet: torch.nn.Module,
+        interval: int,
+        max_timestep_delta: float,
+    ):
+        self.controlnet_call = controlnet._compiled_call_impl or controlnet._call_impl
+        self.interval = interval
+        self.max_timestep_delta = max_timestep_delta
+        self.step = 0
+        self.shape = None
+        self.timestep = None
+        self.outputs = None
+
+    def __call__(self, sample, timestep, *args, **kwargs):
+        step, self.step = self.step, self.step + 1
+        if (
+            step % self.interval != 0
+            and self.shape == sample.shape
+            and abs(self.timestep - float(timestep)) <= self.max_timestep_delta
+        ):
+            return self.outputs
+        self.outputs = self.controlnet_call(sample, timestep, *args, **kwargs)
+        self.shape = sample.shape
+        self.timestep = float(timestep)
+        return self.outputs
+
+
 class GenericControlNetXLLoraModel(GenericPeftModel, QuantizationMixin):
     prefix_keys_in_state_dict = {
         # unet weights
@@ -154,6 +190,7 @@ class GenericControlNetXLLoraModel(GenericPeftModel, QuantizationMixin):
             self.text2.add_adapter(lora_config)
         if enable_unet_adapter:
             self.unet.add_adapter(lora_config)
+        self.enable_unet_adapter = enable_unet_adapter
 
     def get_prompt_outputs(
         self,
@@ -336,7 +373,7 @@ class ControlNetXLLoraForText2ImageGeneration(GenericControlNetXLLoraModel):
         latents = self.vae.encode(pixel_values).latent_dist.sample()
         latents = latents * self.vae.config.scaling_factor
 
-        noise = torch.randn(latents.shape).to(latents.device)
+        noise = torch.randn(latents.shape, device=latents.device)
         batch = latents.size(0)
 
         timesteps = torch.randint(
@@ -396,6 +433,8 @@ class ControlNetXLLoraForText2ImageGeneration(GenericControlNetXLLoraModel):
         width: Optional[int] = 1024,
         guidance_scale: Optional[float] = 5.0,
         controlnet_conditioning_scale: Optional[float] = 1.0,
+        lora_patch_step: Optional[int] = None,
+        controlnet_cache_interval: Optional[int] = None,
     ):
         """
         Generate images using the model.
@@ -413,6 +452,8 @@ class ControlNetXLLoraForText2ImageGeneration(GenericControlNetXLLoraModel):
             height (Optional[int]): Height of the generated images (default: 1024).
             width (Optional[int]): Width of the generated images (default: 1024).
             guidance_scale (Optional[float]): Scale for guidance (default: 5.0).
+            lora_patch_step (Optional[int]): Denoising step from which the unet lora adapter is enabled; the earlier steps run without it (default: None, all steps).
+            controlnet_cache_interval (Optional[int]): Run the controlnet every n denoising steps and reuse its last residuals in between (default: None, every step).
 
         Returns:
             GenericOutputs: Generated images.
@@ -427,21 +468,54 @@ class ControlNetXLLoraForText2ImageGeneration(GenericControlNetXLLoraModel):
             negative_attention_mask=negative_attention_mask,
             negative_attention2_mask=negative_attention2_mask,
         )
-        images = self.pipeline(
-            image=condition_pixel_values,
-            prompt_embeds=outputs.prompt_embeds,
-            negative_prompt_embeds=outputs.negative_prompt_embeds,
-            pooled_prompt_embeds=outputs.pooled_prompt_embeds,
-            negative_pooled_prompt_embeds=outputs.negative_pooled_prompt_embeds,
-            generator=torch.Generator(device=self.pipeline.device).manual_seed(
-                self.seed
-            ),
-            num_inference_steps=self.num_infer_timesteps,
-            height=height,
-            width=width,
-            guidance_scale=guidance_scale,
-            controlnet_conditioning_scale=float(controlnet_conditioning_scale),
-            output_type="np.array",
-        ).images
-
-        return GenericOutputs(images=torch.from_numpy(images))
+        callback_on_step_end = None
+        if self.enable_unet_adapter and lora_patch_step is not None:
+            lora_patch_step = min(int(lora_patch_step), self.num_infer_timesteps)
+
+            def callback_on_step_end(pipeline, step, timestep, callback_kwargs):
+                if step + 1 == lora_patch_step:
+                    self.unet.enable_adapters()
+                return callback_kwargs
+
+            if lora_patch_step > 0:
+                self.unet.disable_adapters()
+
+        compiled_call_impl = self.controlnet._compiled_call_impl
+        if controlnet_cache_interval is not None and controlnet_cache_interval > 1:
+            controlnet_cache_interval = int(controlnet_cache_interval)
+            # reuse residuals only within one cache window of timesteps
+            max_timestep_delta = (
+                controlnet_cache_interval
+                * self.scheduler.config.num_train_timesteps
+                / self.num_infer_timesteps
+            )
+            self.controlnet._compiled_call_impl = _ControlNetResidualCache(
+                self.controlnet,
+                interval=controlnet_cache_interval,
+                max_timestep_delta=max_timestep_delta,
+            )
+
+        try:
+            images = self.pipeline(
+                image=condition_pixel_values,
+                prompt_embeds=outputs.prompt_embeds,
+                negative_prompt_embeds=outputs.negative_prompt_embeds,
+                pooled_prompt_embeds=outputs.pooled_prompt_embeds,
+                negative_pooled_prompt_embeds=outputs.negative_pooled_prompt_embeds,
+                generator=torch.Generator(device=self.pipeline.device).manual_seed(
+                    self.seed
+                ),
+                num_inference_steps=self.num_infer_timesteps,
+                height=height,
+                width=width,
+                guidance_scale=guidance_scale,
+                controlnet_conditioning_scale=float(controlnet_conditioning_scale),
+                output_type="pt",
+                callback_on_step_end=callback_on_step_end,
+            ).images
+        finally:
+            if callback_on_step_end is not None:
+                self.unet.enable_adapters()
+            self.controlnet._compiled_call_impl = compiled_call_impl
+
+        return GenericOutputs(images=images.float().permute(0, 2, 3, 1))
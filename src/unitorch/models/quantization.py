@@ -2,12 +2,13 @@
 # Licensed under the MIT License.
 
 import json
+import torch.nn as nn
 from transformers.utils.quantization_config import BitsAndBytesConfig
 from transformers.utils.bitsandbytes import (
     replace_with_bnb_linear,
     set_module_quantized_tensor_to_device,
 )
-from unitorch.utils import is_bitsandbytes_available
+from unitorch.utils import is_bitsandbytes_available, is_torchao_available
 
 
 def quantize_model(model, config, ignore_modules):
@@ -28,6 +29,60 @@ def quantize_model(model, config, ignore_modules):
     return model
 
 
+def _quantize_model_weight_only(model, method, modules=None, ignore_modules=None):
+    assert is_torchao_available(), "Please install torchao first."
+    from torchao.quantization import quantize_
+
+    if ignore_modules is None:
+        ignore_modules = ["lora_"]
+
+    def filter_fn(module, name):
+        if not isinstance(module, nn.Linear):
+            return False
+        if modules is not None and not any(name.startswith(m) for m in modules):
+            return False
+        return not any(m in name for m in ignore_modules)
+
+    quantize_(model, method, filter_fn=filter_fn)
+    return model
+
+
+def quantize_model_float8(model, modules=None, ignore_modules=None):
+    assert is_torchao_available(), "Please install torchao first."
+    from torchao.quantization import float8_weight_only
+
+    return _quantize_model_weight_only(
+        model, float8_weight_only(), modules, ignore_modules
+    )
+
+
+def quantize_model_float8_dynamic(model, modules=None, ignore_modules=None):
+    assert is_torchao_available(), "Please install torchao first."
+    from torchao.quantization import float8_dynamic_activation_float8_weight
+
+    return _quantize_model_weight_only(
+        model, float8_dynamic_activation_float8_weight(), modules, ignore_modules
+    )
+
+
+def quantize_model_int8(model, modules=None, ignore_modules=None):
+    assert is_torchao_available(), "Please install torchao first."
+    from torchao.quantization import int8_weight_only
+
+    return _quantize_model_weight_only(
+        model, int8_weight_only(), modules, ignore_modules
+    )
+
+
+def quantize_model_int8_dynamic(model, modules=None, ignore_modules=None):
+    assert is_torchao_available(), "Please install torchao first."
+    from torchao.quantization import int8_dynamic_activation_int8_weight
+
+    return _quantize_model_weight_only(
+        model, int8_dynamic_activation_int8_weight(), modules, ignore_modules
+    )
+
+
 class QuantizationConfig(BitsAndBytesConfig):
     @classmethod
     def from_json_file(cls, json_file: str):
@@ -39,3 +94,15 @@ class QuantizationConfig(BitsAndBytesConfig):
 class QuantizationMixin:
     def quantize(self, config: QuantizationConfig, ignore_modules=None):
         return quantize_model(self, config, ignore_modules)
+
+    def quantize_float8(self, modules=None, ignore_modules=None):
+        return quantize_model_float8(self, modules, ignore_modules)
+
+    def quantize_float8_dynamic(self, modules=None, ignore_modules=None):
+        return quantize_model_float8_dynamic(self, modules, ignore_modules)
+
+    def quantize_int8(self, modules=None, ignore_modules=None):
+        return quantize_model_int8(self, modules, ignore_modules)
+
+    def quantize_int8_dynamic(self, modules=None, ignore_modules=None):
+        return quantize_model_int8_dynamic(self, modules, ignore_modules)
@@ -2,6 +2,7 @@
 # Licensed under the MIT License.
 
 import os
+import copy
 import json
 import random
 import logging
@@ -9,6 +10,7 @@ import torch
 import torch.nn as nn
 import torch.distributed as dist
 import torch.nn.functional as F
+from functools import lru_cache
 from typing import Any, Callable, Dict, List, Optional, Set, Tuple, Union
 
 from transformers.models.siglip.modeling_siglip import (
@@ -16,11 +18,40 @@ from transformers.models.siglip.modeling_siglip import (
     SiglipTextTransformer,
     SiglipVisionTransformer,
 )
+from unitorch.utils import read_json_file
 from unitorch.models import GenericModel
 from unitorch.models.peft import PeftWeightLoaderMixin
 from unitorch.models.clip.modeling import _clip_loss, AllGather
 
 
+@lru_cache(maxsize=64)
+def _load_siglip_config_dict(config_path: str) -> Dict[str, Any]:
+    return read_json_file(config_path)
+
+
+def _load_siglip_config(config_path: str) -> SiglipConfig:
+    # parse each config file once, the heads mutate their config so copy the dict
+    return SiglipConfig.from_dict(copy.deepcopy(_load_siglip_config_dict(config_path)))
+
+
+def _siglip_pretrain_loss(
+    text_embeds: torch.Tensor,
+    image_embeds: torch.Tensor,
+    logit_scale: torch.Tensor,
+) -> torch.Tensor:
+    logits_per_text = torch.matmul(text_embeds, image_embeds.t()) * logit_scale.exp()
+    return _clip_loss(logits_per_text)
+
+
+def _siglip_matching_scores(
+    text_embeds: torch.Tensor,
+    image_embeds: torch.Tensor,
+) -> torch.Tensor:
+    image_embeds = image_embeds / image_embeds.norm(dim=-1, keepdim=True)
+    text_embeds = text_embeds / text_embeds.norm(dim=-1, keepdim=True)
+    return torch.sum(text_embeds * image_embeds, dim=-1, keepdim=True)
+
+
 class SiglipForPretrain(GenericModel):
     """
     Siglip model for pretraining.
@@ -45,7 +76,7 @@ class SiglipForPretrain(GenericModel):
         """
         super().__init__()
 
-        config = SiglipConfig.from_json_file(config_path)
+        config = _load_siglip_config(config_path)
         text_config = config.text_config
         vision_config = config.vision_config
         text_config.gradient_checkpointing = gradient_checkpointing
@@ -61,6 +92,8 @@ class SiglipForPretrain(GenericModel):
         self.vision_model = SiglipVisionTransformer(vision_config)
 
         self.logit_scale = nn.Parameter(torch.ones([]) * config.logit_scale_init_value)
+        # similarity + loss tail, can be swapped for a compiled version
+        self.pretrain_loss = _siglip_pretrain_loss
 
         self.init_weights()
 
@@ -126,12 +159,10 @@ class SiglipForPretrain(GenericModel):
         image_embeds = image_embeds / image_embeds.norm(dim=-1, keepdim=True)
         text_embeds = text_embeds / text_embeds.norm(dim=-1, keepdim=True)
 
-        logit_scale = self.logit_scale.exp()
         if self.use_all_gather and dist.is_initialized():
             text_embeds = self._all_gather(text_embeds)
             image_embeds = self._all_gather(image_embeds)
-        logits_per_text = torch.matmul(text_embeds, image_embeds.t()) * logit_scale
-        return _clip_loss(logits_per_text)
+        return self.pretrain_loss(text_embeds, image_embeds, self.logit_scale)
 
 
 class SiglipForClassification(GenericModel):
@@ -153,7 +184,7 @@ class SiglipForClassification(GenericModel):
             gradient_checkpointing (Optional[bool]): Whether to enable gradient_checkpointing.
         """
         super().__init__()
-        config = SiglipConfig.from_json_file(config_path)
+        config = _load_siglip_config(config_path)
         text_config = config.text_config
         vision_config = config.vision_config
         text_config.gradient_checkpointing = gradient_checkpointing
@@ -238,7 +269,7 @@ class SiglipForTextClassification(GenericModel):
             gradient_checkpointing (bool, optional): Whether to use gradient checkpointing. Defaults to False.
         """
         super().__init__()
-        config = SiglipConfig.from_json_file(config_path)
+        config = _load_siglip_config(config_path)
         text_config = config.text_config
         text_config.gradient_checkpointing = gradient_checkpointing
 
@@ -305,7 +336,7 @@ class SiglipForImageClassification(GenericModel):
             gradient_checkpointing (bool, optional): Whether to use gradient checkpointing. Defaults to False.
         """
         super().__init__()
-        config = SiglipConfig.from_json_file(config_path)
+        config = _load_siglip_config(config_path)
         vision_config = config.vision_config
         vision_config.gradient_checkpointing = gradient_checkpointing
 
@@ -366,7 +397,7 @@ class SiglipForMatching(GenericModel, PeftWeightLoaderMixin):
             gradient_checkpointing (Optional[bool]): Whether to enable gradient_checkpointing.
         """
         super().__init__()
-        config = SiglipConfig.from_json_file(config_path)
+        config = _load_siglip_config(config_path)
         text_config = config.text_config
         vision_config = config.vision_config
         text_config.gradient_checkpointing = gradient_checkpointing
@@ -382,6 +413,8 @@ class SiglipForMatching(GenericModel, PeftWeightLoaderMixin):
         self.vision_model = SiglipVisionTransformer(vision_config)
 
         self.classifier = nn.Linear(1, 1)
+        # normalize + similarity tail, can be swapped for a compiled version
+        self.matching_scores = _siglip_matching_scores
 
         self.init_weights()
         self.classifier.weight.data.fill_(5.0)
@@ -431,10 +464,7 @@ class SiglipForMatching(GenericModel, PeftWeightLoaderMixin):
 
         text_embeds = text_outputs[1]
 
-        image_embeds = image_embeds / image_embeds.norm(dim=-1, keepdim=True)
-        text_embeds = text_embeds / text_embeds.norm(dim=-1, keepdim=True)
-
-        scores = torch.sum(text_embeds * image_embeds, dim=-1, keepdim=True)
+        scores = self.matching_scores(text_embeds, image_embeds)
 
         outputs = self.classifier(scores)
         return outputs
@@ -12,10 +12,10 @@ from unitorch.models import HfTextGenerationProcessor
 
 def get_t5_tokenizer(
     vocab_path,
-    special_input_ids=dict(),
+    special_input_ids: Optional[Dict] = None,
 ):
     tokenizer = T5Tokenizer(vocab_path)
-    for token, _id in special_input_ids.items():
+    for token, _id in (special_input_ids or {}).items():
         tokenizer.added_tokens_encoder[token] = _id
         tokenizer.unique_no_split_tokens.append(token)
         tokenizer.added_tokens_decoder[_id] = token
@@ -31,7 +31,7 @@ class T5Processor(HfTextGenerationProcessor):
     def __init__(
         self,
         vocab_path: str,
-        special_input_ids: Optional[Dict] = dict(),
+        special_input_ids: Optional[Dict] = None,
         max_seq_length: Optional[int] = 128,
         max_gen_seq_length: Optional[int] = 48,
     ):
@@ -40,13 +40,14 @@ class T5Processor(HfTextGenerationProcessor):
 
         Args:
             vocab_path (str): Path to the vocabulary file.
-            special_input_ids (Optional[Dict]): Special input IDs. Defaults to an empty dictionary.
+            special_input_ids (Optional[Dict]): Special input IDs. Defaults to None (no special tokens).
             max_seq_length (Optional[int]): Maximum sequence length. Defaults to 128.
             max_gen_seq_length (Optional[int]): Maximum generated sequence length. Defaults to 48.
         """
+        self._special_input_ids = dict(special_input_ids or {})
         tokenizer = get_t5_tokenizer(
             vocab_path,
-            special_input_ids=special_input_ids,
+            special_input_ids=self._special_input_ids,
         )
         tokenizer.bos_token_id = 0
         tokenizer.bos_token = tokenizer.convert_ids_to_tokens(0)
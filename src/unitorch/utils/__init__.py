@@ -19,7 +19,7 @@ import safetensors
 from filelock import FileLock
 from contextlib import contextmanager
 from torch.multiprocessing import spawn
-from functools import partial, wraps
+from functools import lru_cache, partial, wraps
 from hashlib import sha256
 from pathlib import Path
 from zipfile import ZipFile, is_zipfile
@@ -54,6 +54,7 @@ from unitorch.utils.import_utils import (
     is_opencv_available,
     is_bitsandbytes_available,
     is_auto_gptq_available,
+    is_torchao_available,
     is_onnxruntime_available,
     is_bfloat16_available,
     is_cuda_available,
@@ -368,10 +369,55 @@ def read_json_file(file):
         return json.load(f)
 
 
+_RANDOM_NN_INITS = (
+    "uniform_",
+    "normal_",
+    "trunc_normal_",
+    "kaiming_uniform_",
+    "kaiming_normal_",
+    "xavier_uniform_",
+    "xavier_normal_",
+    "orthogonal_",
+)
+
+
+@contextmanager
+def suspend_nn_inits():
+    """
+    Skip the random parameter initializations of torch.nn modules built inside the context.
+    Use it only when every parameter is overwritten by pretrained weights afterwards.
+    Constant initializations (zeros_, ones_, constant_) still run, zero convs stay zero.
+    """
+    saved = {name: getattr(torch.nn.init, name) for name in _RANDOM_NN_INITS}
+    try:
+        for name in _RANDOM_NN_INITS:
+            setattr(torch.nn.init, name, lambda tensor, *args, **kwargs: tensor)
+        yield
+    finally:
+        for name, func in saved.items():
+            setattr(torch.nn.init, name, func)
+
+
+@lru_cache(maxsize=None)
+def _compile_key_patterns(patterns: Tuple[Tuple[str, str], ...]):
+    return tuple((re.compile(rkey), nkey) for rkey, nkey in patterns)
+
+
+def _torch_load_weight(path):
+    try:
+        # memory-map the checkpoint so tensors are paged in on demand
+        return torch.load(path, map_location="cpu", mmap=True, weights_only=True)
+    except (RuntimeError, TypeError):
+        # legacy (non-zipfile) checkpoints or torch<2.1 can't be memory-mapped
+        return torch.load(path, map_location="cpu", weights_only=True)
+
+
 def load_weight(
     path,
     replace_keys: Optional[Dict] = dict(),
     prefix_keys: Optional[Dict] = dict(),
+    key_map: Optional[Dict] = None,
+    rewrite_key: Optional[Callable[[str], str]] = None,
 ):
     if isinstance(path, str):
         path = [path]
@@ -380,20 +426,31 @@ def load_weight(
     for p in path:
         if p.endswith(".safetensors"):
             p = cached_path(p)
-            state_dict = {**state_dict, **safetensors.torch.load_file(p)}
+            state_dict.update(safetensors.torch.load_file(p))
         else:
             p = cached_path(p)
-            state_dict = {**state_dict, **torch.load(p, map_location="cpu")}
+            state_dict.update(_torch_load_weight(p))
+
+    prefix_patterns = _compile_key_patterns(tuple(prefix_keys.items()))
+    replace_patterns = _compile_key_patterns(tuple(replace_keys.items()))
+    key_map = key_map if key_map is not None else dict()
 
     results = dict()
     for key, value in list(state_dict.items()):
-        for rkey, prefix in prefix_keys.items():
-            if re.match(rkey, key):
+        if key in key_map:
+            results[key_map[key]] = value
+            continue
+
+        for pattern, prefix in prefix_patterns:
+            if pattern.match(key):
                 key = prefix + key
                 break
 
-        for rkey, nkey in replace_keys.items():
-            key = re.sub(rkey, nkey, key)
+        if rewrite_key is not None:
+            key = rewrite_key(key)
+
+        for pattern, nkey in replace_patterns:
+            key = pattern.sub(nkey, key)
 
         results[key] = value
 
@@ -118,6 +118,19 @@ def is_auto_gptq_available():
     return _auto_gptq_available or is_offline_debug_mode()
 
 
+# torchao
+_torchao_available = importlib.util.find_spec("torchao") is not None
+try:
+    _torchao_version = importlib_metadata.version("torchao")
+    logging.debug(f"Successfully imported torchao version {_torchao_version}")
+except importlib_metadata.PackageNotFoundError:
+    _torchao_available = False
+
+
+def is_torchao_available():
+    return _torchao_available or is_offline_debug_mode()
+
+
 # onnxruntime
 _onnxruntime_available = importlib.util.find_spec("onnxruntime") is not None
 try:
@@ -0,0 +1,66 @@
+# Copyright (c) FULIUCANSHENG.
+# Licensed under the MIT License.
+
+import os
+import tempfile
+import torch
+from absl.testing import absltest, parameterized
+from diffusers.schedulers import DDIMScheduler, EulerDiscreteScheduler
+from unitorch.cli.models.diffusion_utils import (
+    DiffusionOutputs,
+    DiffusionProcessor,
+    cache_scheduler_timesteps,
+)
+
+
+class DiffusionProcessorTest(parameterized.TestCase):
+    def setUp(self):
+        self.output_folder = tempfile.mkdtemp()
+        self.processor = DiffusionProcessor(output_folder=self.output_folder)
+
+    @parameterized.named_parameters(
+        {"testcase_name": "float32 images", "dtype": torch.float32},
+        {"testcase_name": "float16 images", "dtype": torch.float16},
+        {"testcase_name": "bfloat16 images", "dtype": torch.bfloat16},
+    )
+    def test_diffusion_image(self, dtype: torch.dtype):
+        # generate returns output_type="pt" images permuted to NHWC
+        images = torch.rand(2, 3, 16, 16).to(dtype).permute(0, 2, 3, 1)
+        outputs = DiffusionOutputs(outputs=images)
+
+        results = self.processor._diffusion_image(outputs).outputs
+
+        self.assertEqual(len(results["diffusion"]), 2)
+        for name in results["diffusion"]:
+            self.assertTrue(os.path.exists(f"{self.output_folder}/{name}"))
+
+
+class CacheSchedulerTimestepsTest(parameterized.TestCase):
+    @parameterized.named_parameters(
+        {"testcase_name": "ddim scheduler", "scheduler_cls": DDIMScheduler},
+        {"testcase_name": "euler scheduler", "scheduler_cls": EulerDiscreteScheduler},
+    )
+    def test_cached_timesteps(self, scheduler_cls):
+        cached = scheduler_cls()
+        cache_scheduler_timesteps(cached)
+        uncached = scheduler_cls()
+
+        # repeat a step count so the second 20 is replayed from the snapshot
+        for num_inference_steps in [20, 30, 20]:
+            cached.set_timesteps(num_inference_steps)
+            uncached.set_timesteps(num_inference_steps)
+            assert cached.timesteps.equal(uncached.timesteps)
+
+            # stepping mutates the scheduler state the snapshot must restore
+            sample = torch.ones(1, 4, 8, 8)
+            model_output = torch.full_like(sample, 0.1)
+            for timestep in cached.timesteps[:3]:
+                cached_sample = cached.step(model_output, timestep, sample)
+                uncached_sample = uncached.step(model_output, timestep, sample)
+                assert torch.allclose(
+                    cached_sample.prev_sample, uncached_sample.prev_sample
+                )
+
+
+if __name__ == "__main__":
+    absltest.main()
@@ -0,0 +1,43 @@
+# Copyright (c) FULIUCANSHENG.
+# Licensed under the MIT License.
+
+from absl.testing import absltest, parameterized
+from unitorch.utils import _compile_key_patterns
+from unitorch.cli.models.peft.diffusers.modeling_controlnet_xl import (
+    _CONTROLNET_XL_LORA_REPLACE_KEYS,
+    _rewrite_controlnet_xl_lora_key,
+)
+
+
+class ControlNetXLLoraKeyRewriterTest(parameterized.TestCase):
+    @parameterized.named_parameters(
+        {
+            "testcase_name": "unet attention key",
+            "key": "unet.down_blocks.1.attentions.0.transformer_blocks.0.attn1.to_k.weight",
+        },
+        {
+            "testcase_name": "unet attention output key",
+            "key": "unet.mid_block.attentions.0.transformer_blocks.0.attn2.to_out.0.bias",
+        },
+        {
+            "testcase_name": "text encoder key",
+            "key": "text2.text_model.encoder.layers.3.self_attn.out_proj.weight",
+        },
+        {
+            "testcase_name": "untouched key",
+            "key": "unet.conv_in.weight",
+        },
+    )
+    def test_rewrite_key(self, key: str):
+        # the replace loop load_weight runs for the same rules
+        expected = key
+        for pattern, nkey in _compile_key_patterns(
+            tuple(_CONTROLNET_XL_LORA_REPLACE_KEYS.items())
+        ):
+            expected = pattern.sub(nkey, expected)
+
+        assert _rewrite_controlnet_xl_lora_key(key) == expected
+
+
+if __name__ == "__main__":
+    absltest.main()
@@ -0,0 +1,52 @@
+# Copyright (c) FULIUCANSHENG.
+# Licensed under the MIT License.
+
+import os
+import json
+import tempfile
+from absl.testing import absltest, parameterized
+from unitorch.models.siglip import SiglipForPretrain
+from unitorch.cli.models.siglip.modeling import _enable_gradient_checkpointing
+
+
+class SiglipGradientCheckpointingTest(parameterized.TestCase):
+    def setUp(self):
+        # a tiny two layer siglip, enough to build the text and vision towers
+        config = {
+            "text_config": {
+                "hidden_size": 32,
+                "intermediate_size": 64,
+                "num_hidden_layers": 2,
+                "num_attention_heads": 2,
+                "vocab_size": 128,
+                "max_position_embeddings": 16,
+            },
+            "vision_config": {
+                "hidden_size": 32,
+                "intermediate_size": 64,
+                "num_hidden_layers": 2,
+                "num_attention_heads": 2,
+                "image_size": 32,
+                "patch_size": 16,
+            },
+        }
+        self.config_path = os.path.join(tempfile.mkdtemp(), "config.json")
+        with open(self.config_path, "w") as f:
+            json.dump(config, f)
+
+    def test_enable_gradient_checkpointing(self):
+        model = SiglipForPretrain(
+            self.config_path,
+            freeze_base_model=False,
+            gradient_checkpointing=False,
+        )
+
+        _enable_gradient_checkpointing(model)
+
+        for encoder in [model.text_model.encoder, model.vision_model.encoder]:
+            self.assertTrue(encoder.gradient_checkpointing)
+            self.assertTrue(hasattr(encoder, "_gradient_checkpointing_func"))
+
+
+if __name__ == "__main__":
+    absltest.main()
@@ -0,0 +1,59 @@
+# Copyright (c) FULIUCANSHENG.
+# Licensed under the MIT License.
+
+import copy
+import pickle
+import torch
+from absl.testing import absltest, parameterized
+from unitorch.models.t5 import T5Processor
+from unitorch.cli import cached_path, hf_endpoint_url
+from unitorch.cli.models import GenerationOutputs
+from unitorch.cli.models.t5 import T5Processor as CliT5Processor
+
+
+class T5ProcessorTest(parameterized.TestCase):
+    def setUp(self):
+        # Download the vocabulary file if it is not already cached
+        self.vocab_path = cached_path(
+            hf_endpoint_url("/t5-small/resolve/main/spiece.model")
+        )
+
+    @parameterized.named_parameters(
+        {
+            "testcase_name": "pickle t5 processor",
+            "encode": "test text for t5 model",
+        }
+    )
+    def test_pickle(self, encode: str):
+        process = T5Processor(self.vocab_path)
+
+        # DataLoader workers started with spawn receive a pickled processor
+        restored = pickle.loads(pickle.dumps(process))
+        cloned = copy.deepcopy(process)
+
+        inputs = process.generation_inputs(encode).input_ids
+        assert restored.generation_inputs(encode).input_ids.equal(inputs)
+        assert cloned.generation_inputs(encode).input_ids.equal(inputs)
+
+    @parameterized.named_parameters(
+        {
+            "testcase_name": "pickle t5 processor after detokenize",
+            "encode": "test text for t5 model",
+        }
+    )
+    def test_pickle_after_detokenize(self, encode: str):
+        process = CliT5Processor(self.vocab_path)
+        sequences = torch.stack([process.generation_inputs(encode).input_ids] * 4)
+        outputs = GenerationOutputs(sequences=sequences)
+
+        # detokenizing several rows goes through the shared thread pool
+        decoded = process._detokenize(outputs).outputs["decoded"].tolist()
+        restored = pickle.loads(pickle.dumps(process))
+        cloned = copy.deepcopy(process)
+
+        assert restored._detokenize(outputs).outputs["decoded"].tolist() == decoded
+        assert cloned._detokenize(outputs).outputs["decoded"].tolist() == decoded
+
+
+if __name__ == "__main__":
+    absltest.main()